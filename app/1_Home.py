@@ -3,7 +3,7 @@ import streamlit as st
 import requests
 import pandas as pd
 import altair as alt
-from utils.regions import REGIONS, states_for_regions
+from utils.regions import REGIONS, region_params
 
 
 API = "http://api_service:8000"
@@ -80,22 +80,20 @@ selected_regions = ["All"] if tog["All"] else [
 
 st.caption(f"**Selected Regions:** {', '.join(selected_regions)}")
 
-# --- convert region → states ---
-states_list = states_for_regions(selected_regions)
-params_for_agg = {}
-if states_list:  # empty means All
-    params_for_agg["states"] = ",".join(states_list)
+# --- region scope (the API resolves names → states and serves precomputed region rollups) ---
+params_for_agg = region_params(selected_regions)
 
 
 # || ================= Manufacturer Charts ================= ||
-by_kitmfg = fetch_json(f"{API}/kits/agg/by_kitmfg", params=params_for_agg)
+# Server returns just the top 10 plus the grand total (used by the Vans donut below)
+agg_kitmfg = fetch_json(f"{API}/kits/agg/by_kitmfg", params={**params_for_agg, "top": 10})
+by_kitmfg = agg_kitmfg["items"]
 st.subheader("Top Kit Aircraft Manufacturers by Count")
 
 df_mfg = (
     pd.DataFrame(by_kitmfg)
       .rename(columns={"kitmfg": "Manufacturer", "count": "Count"})
       .sort_values("Count", ascending=False)
-      .head(10)
 )
 # Identify top manufacturer
 top_mfg = df_mfg.iloc[0]["Manufacturer"]
@@ -132,11 +130,14 @@ st.altair_chart(bars + labels, use_container_width=True)
 # || ================= Donut: Vans vs Others ================= ||
 VANS_NAME = "VANS AIRCRAFT INC"
 
-total_mfg = sum(d["count"] for d in by_kitmfg if d.get("kitmfg"))
+total_mfg = agg_kitmfg["total"]
 vans_count = next(
     (d["count"] for d in by_kitmfg if (d.get("kitmfg") or "").strip().upper() == VANS_NAME),
-    0,
+    None,
 )
+if vans_count is None:
+    # Vans outside this region's top 10: ask for its count directly
+    vans_count = fetch_json(f"{API}/kits/facets", params={**params_for_agg, "kitmfg": VANS_NAME})["total"]
 other_count = max(total_mfg - vans_count, 0)
 
 st.caption("Proportion of Vans Aircraft to all other manufacturers.")
@@ -184,7 +185,9 @@ st.altair_chart(donut + center_text, use_container_width=True)
 
 st.markdown("----")
 # || ================= State chart (horizontal, top 10) ================= ||
-by_state = fetch_json(f"{API}/kits/agg/by_state", params=params_for_agg)
+TOP_N = 10
+agg_state = fetch_json(f"{API}/kits/agg/by_state", params={**params_for_agg, "top": TOP_N + 1})
+by_state = agg_state["items"]   # one spare in case a blank state lands in the top N
 
 # Build dataframe, drop blanks
 df_states = (
@@ -193,16 +196,11 @@ df_states = (
 )
 df_states = df_states[df_states["State"].notna() & (df_states["State"] != "")]
 
-# Enforce region filter on the client too (belt & suspenders)
-if states_list:
-    df_states = df_states[df_states["State"].isin(states_list)]
-
 # Top-N within the selected region(s)
-TOP_N = 10
 df_top = df_states.sort_values("Count", ascending=False).head(TOP_N)
 
 region_label = ", ".join(selected_regions) if selected_regions else "All"
-st.subheader(f"Top {min(TOP_N, len(df_states))} States by Aircraft Count — {region_label}")
+st.subheader(f"Top {min(TOP_N, len(df_top))} States by Aircraft Count — {region_label}")
 
 if df_top.empty:
     st.info("No state-level data available for the selected region(s).")
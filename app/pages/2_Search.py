@@ -3,7 +3,7 @@ import streamlit as st
 import pandas as pd
 import requests
 
-from utils.regions import REGIONS, states_for_regions  # REGIONS = ["All","North","South","East","West"]
+from utils.regions import REGIONS, region_params  # REGIONS = ["All","North","South","East","West"]
 
 API = "http://api_service:8000"
 
@@ -61,14 +61,14 @@ def current_regions():
     tog = st.session_state.region_toggles
     return ["All"] if tog["All"] else [r for r in ["North","South","East","West"] if tog[r]]
 
-def build_params(page_size, page_num, kitmfg, kitmdl, states_csv):
+def build_params(page_size, page_num, kitmfg, kitmdl, scope):
     params = {
         "limit": page_size,
         "offset": (page_num - 1) * page_size,
+        **scope,
     }
     if kitmfg: params["kitmfg"] = kitmfg
     if kitmdl: params["kitmdl"] = kitmdl
-    if states_csv: params["states"] = states_csv
     return params
 
 # ---------- state ----------
@@ -95,25 +95,40 @@ with st.sidebar:
     selected_regions = current_regions()
     st.caption(f"Selected Regions: {', '.join(selected_regions)}")
 
-    # Region → states CSV (optional)
-    states_list = states_for_regions(selected_regions)
-    states_csv = ",".join(states_list) if states_list else ""
+    # Region scope (optional); the API owns the region → states mapping
+    scope = region_params(selected_regions)
 
     # Extra state picker (refines the region)
     all_states = fetch_json(f"{API}/kits/filters/states")
     picked_states = st.multiselect("States (optional)", options=sorted(all_states), key="search_states")
     if picked_states:
-        states_csv = ",".join(picked_states)  # explicit selection wins
+        scope = {"states": ",".join(picked_states)}  # explicit selection wins
 
     st.divider()
 
-    # Kit manufacturer + dependent model
-    kitmfgs = fetch_json(f"{API}/kits/filters/kitmfgs")
-    kitmfg = st.selectbox("Kit Manufacturer", [""] + kitmfgs, key="search_kitmfg")
+    # Kit manufacturer + dependent model, with live counts under the current filters.
+    # Each facet ignores its own selection, so the manufacturer list stays stable once picked.
+    # (Widget state already holds the new selection when the script reruns.)
+    prev_kitmfg = st.session_state.get("search_kitmfg") or ""
+    prev_kitmdl = st.session_state.get("search_kitmdl") or ""
+    facet_params = dict(scope)
+    if prev_kitmfg: facet_params["kitmfg"] = prev_kitmfg
+    facet_data = fetch_json(f"{API}/kits/facets", params=facet_params)
+    counts = {f: {d["value"]: d["count"] for d in rows if d["value"]} for f, rows in facet_data["facets"].items()}
+
+    def with_count(facet):
+        return lambda v: f"{v} ({counts[facet].get(v, 0):,})" if v else ""
+
+    kitmfgs = sorted(counts["kitmfg"])
+    if prev_kitmfg and prev_kitmfg not in kitmfgs:
+        kitmfgs.append(prev_kitmfg)  # keep a selection that the new scope emptied
+    kitmfg = st.selectbox("Kit Manufacturer", [""] + kitmfgs, key="search_kitmfg", format_func=with_count("kitmfg"))
 
     if kitmfg:
-        models = fetch_json(f"{API}/kits/filters/kitmdls", params={"kitmfg": kitmfg})
-        kitmdl = st.selectbox("Model", [""] + (models if isinstance(models, list) else []), key="search_kitmdl")
+        models = sorted(counts["kitmdl"])
+        if prev_kitmdl and prev_kitmdl not in models:
+            st.session_state.pop("search_kitmdl", None)
+        kitmdl = st.selectbox("Model", [""] + models, key="search_kitmdl", format_func=with_count("kitmdl"))
     else:
         kitmdl = ""
         st.selectbox("Model", [""], disabled=True, key="search_kitmdl")
@@ -150,7 +165,7 @@ with right:
     c3.metric("Page", st.session_state.page_num)
 
 # ---------- fetch & render ----------
-params = build_params(page_size, st.session_state.page_num, kitmfg, kitmdl, states_csv)
+params = build_params(page_size, st.session_state.page_num, kitmfg, kitmdl, scope)
 rows = fetch_json(f"{API}/kits", params=params)
 
 df = pd.DataFrame(rows)
@@ -175,6 +190,6 @@ st.dataframe(df, use_container_width=True, height=520)
 
 # ---------- notes ----------
 st.caption(
-    "Tip: Region toggles build a state filter for the API. "
+    "Tip: Region toggles scope the API query by region. "
     "Use the sidebar **States** picker to narrow further or override the region’s state list."
 )
\ No newline at end of file
@@ -1,20 +1,11 @@
 # app/utils/regions.py
+# Region definitions live in the API (src/regions.py, GET /kits/filters/regions);
+# the app only needs the names for its toggles and sends them as `region=`.
 
 REGIONS = ["All", "North", "South", "East", "West"]
 
-REGION_TO_STATES = {
-    "North": ["CT","ME","MA","NH","NJ","NY","PA","RI","VT","MI","MN","WI","IA","ND","SD","NE","OH","IL","IN"],
-    "South": ["AL","AR","FL","GA","KY","LA","MS","NC","OK","SC","TN","TX","VA","WV","MD","DE","DC"],
-    "East":  ["CT","DE","DC","FL","GA","MA","MD","ME","NC","NH","NJ","NY","PA","RI","SC","VA","VT"],
-    "West":  ["AK","AZ","CA","CO","HI","ID","MT","NM","NV","OR","UT","WA","WY"],
-}
-
-def states_for_regions(selected: list[str]) -> list[str]:
-    # Return [] when "All" (or nothing) is chosen → no filter
+def region_params(selected: list[str]) -> dict:
+    # Return {} when "All" (or nothing) is chosen → no filter
     if not selected or "All" in selected:
-        return []
-    out = []
-    for r in selected:
-        out.extend(REGION_TO_STATES.get(r, []))
-    # dedupe + sort
-    return sorted(set(out))
\ No newline at end of file
+        return {}
+    return {"region": ",".join(sorted(set(selected)))}
@@ -0,0 +1,140 @@
+# src/admission.py
+'''
+Admission control for the API. Every /kits* request belongs to a class:
+
+  lookup     /kits (limit <= EXPORT_LIMIT), POST /kits/lookup
+  aggregate  /kits/agg/*, /kits/facets, /kits/filters/*, /kits/metrics/*
+  export     /kits with limit > EXPORT_LIMIT
+
+Each class has its own concurrency limit and a bounded queue. A request that
+finds the queue full, or waits longer than its queue wait, is shed right away
+with 503 + Retry-After instead of piling up on the connection pool. Admitted
+requests run their SQL under the class's Postgres statement_timeout (SET LOCAL
+at the start of each session transaction).
+
+Limits are per worker process. Override them per class, e.g.
+ADMISSION_EXPORT_CONCURRENCY=1, ADMISSION_AGGREGATE_QUEUE=16,
+ADMISSION_LOOKUP_TIMEOUT_MS=1000, ADMISSION_EXPORT_WAIT=5.
+'''
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event, text
+import metrics
+
+ENABLED = os.getenv("ADMISSION", "1") == "1"
+# /kits pages bigger than this are exports
+EXPORT_LIMIT = int(os.getenv("ADMISSION_EXPORT_LIMIT", "1000"))
+RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+# Postgres cancels with SQLSTATE query_canceled when statement_timeout fires
+QUERY_CANCELED = "57014"
+
+# class -> (concurrency, queue length, max queue wait s, statement_timeout ms)
+DEFAULTS = {
+    "lookup": (8, 32, 1.0, 2000),
+    "aggregate": (4, 16, 2.0, 5000),
+    "export": (1, 2, 5.0, 30000),
+}
+
+# Set for the duration of an admitted request; read by the session hook and error handler
+current_class: ContextVar[str | None] = ContextVar("admission_class", default=None)
+statement_budget_ms: ContextVar[int | None] = ContextVar("statement_budget_ms", default=None)
+
+class Rejected(Exception):
+    def __init__(self, cls: str, reason: str):
+        super().__init__(f"{cls} queue {reason.replace('_', ' ')}")
+        self.cls = cls
+        self.reason = reason
+
+class Gate:
+    def __init__(self, name: str, concurrency: int, queue: int, wait: float, timeout_ms: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.wait = wait
+        self.timeout_ms = timeout_ms
+        self._sem = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem.locked() and self.waiting >= self.queue:
+            raise Rejected(self.name, "full")
+        self.waiting += 1
+        metrics.ADMISSION_QUEUED.inc((self.name,))
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.wait)
+        except asyncio.TimeoutError:
+            raise Rejected(self.name, "wait_timeout")
+        finally:
+            self.waiting -= 1
+            metrics.ADMISSION_QUEUED.dec((self.name,))
+            metrics.ADMISSION_WAIT.observe(time.perf_counter() - t0, (self.name,))
+        metrics.ADMISSION_ACTIVE.inc((self.name,))
+        try:
+            yield self
+        finally:
+            metrics.ADMISSION_ACTIVE.dec((self.name,))
+            self._sem.release()
+
+def _gate(name: str) -> Gate:
+    concurrency, queue, wait, timeout_ms = DEFAULTS[name]
+    env = f"ADMISSION_{name.upper()}_"
+    return Gate(
+        name,
+        concurrency=int(os.getenv(env + "CONCURRENCY", concurrency)),
+        queue=int(os.getenv(env + "QUEUE", queue)),
+        wait=float(os.getenv(env + "WAIT", wait)),
+        timeout_ms=int(os.getenv(env + "TIMEOUT_MS", timeout_ms)),
+    )
+
+GATES = {name: _gate(name) for name in DEFAULTS}
+
+def classify(path: str, query_params) -> str | None:
+    """Admission class for a request path; None for health/ready/metrics/admin (never shed)."""
+    if path == "/kits":
+        try:
+            limit = int(query_params.get("limit", 100))
+        except ValueError:
+            limit = 100   # let validation reject it
+        return "export" if limit > EXPORT_LIMIT else "lookup"
+    if path == "/kits/lookup":
+        return "lookup"
+    if path.startswith("/kits/"):
+        return "aggregate"
+    return None
+
+def gate_for(path: str, query_params) -> Gate | None:
+    if not ENABLED:
+        return None
+    cls = classify(path, query_params)
+    return GATES[cls] if cls else None
+
+def install(sessionmaker):
+    """Apply the admitted request's statement_timeout to every transaction its session opens."""
+    @event.listens_for(sessionmaker, "after_begin")
+    def _set_budget(session, transaction, connection):
+        ms = statement_budget_ms.get()
+        if ms:
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(ms)}")
+
+@contextmanager
+def unbudgeted(db):
+    """
+    Lift the request's statement_timeout for work done on its session that isn't its own
+    query, e.g. an index rebuild the request happens to trigger (see versioned.py). The
+    budget is restored afterwards; on error the transaction is aborted anyway.
+    """
+    ms = statement_budget_ms.get()
+    if not ms:
+        yield
+        return
+    db.execute(text("SET LOCAL statement_timeout = 0"))
+    yield
+    db.execute(text(f"SET LOCAL statement_timeout = {int(ms)}"))
+
+def is_timeout(exc: Exception) -> bool:
+    return getattr(getattr(exc, "orig", None), "sqlstate", None) == QUERY_CANCELED
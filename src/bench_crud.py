@@ -0,0 +1,123 @@
+# src/bench_crud.py
+'''
+Per-call overhead of the crud layer, before vs. after statement caching.
+
+  legacy  the previous style: an ORM Query rebuilt on every call, state lists
+          as expanding IN (...) lists, no server-side prepared statements
+  cached  crud.py as it is now: cached statements on an engine with psycopg
+          prepare_threshold (DB_PREPARE_THRESHOLD)
+
+Both run the same small indexed queries the Search page makes, rotating
+through region scopes so the IN-list length changes from call to call.
+Point DATABASE_URL at a loaded database. On an unpartitioned kits_fact the
+cached arm binds every state list as one array; on a partitioned one the
+state-scoped cases send literal dim_state ids (one SQL text per scope, see
+crud.in_states). The report's state_scope and per-case "sql" say which ran.
+
+    python bench_crud.py --calls 2000
+'''
+import argparse
+import json
+import statistics
+import time
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+import crud
+import regions
+from db import DATABASE_URL, connect_args
+from models import Kit
+
+def legacy_count_by_state(db, states):
+    return db.query(Kit.state, func.count()).filter(Kit.state.in_(states)).group_by(Kit.state).all()
+
+def legacy_city_count(db, states):
+    return db.query(func.count(func.distinct(Kit.city))).filter(Kit.state.in_(states)).scalar()
+
+def legacy_kitmdls(db, kitmfg):
+    q = db.query(Kit.kitmdl).filter(Kit.kitmdl.isnot(None), Kit.kitmfg == kitmfg).distinct().order_by(Kit.kitmdl)
+    return [v for (v,) in q.all()]
+
+def legacy_list_kits(db, kitmfg, states):
+    q = db.query(Kit).filter(Kit.kitmfg == kitmfg, Kit.state.in_(states))
+    return q.count(), q.order_by(Kit.n_number).limit(20).all()
+
+def legacy_by_n_number(db, keys):
+    return db.query(Kit).filter(Kit.n_number.in_(keys)).order_by(Kit.n_number).all()
+
+# Cases whose cached arm takes crud's state-scope path (array bind or literal ids)
+STATE_SCOPED = {"count_by_state", "city_count", "list_kits"}
+
+def cases(scopes: list[list[str]], kitmfg: str, keys: list[list[str]]):
+    """name -> (legacy fn, cached fn), each taking (db, i) for the i-th call."""
+    s = lambda i: scopes[i % len(scopes)]
+    k = lambda i: keys[i % len(keys)]
+    return {
+        "count_by_state": (lambda db, i: legacy_count_by_state(db, s(i)), lambda db, i: crud.count_by_state(db, s(i))),
+        "city_count": (lambda db, i: legacy_city_count(db, s(i)), lambda db, i: crud.count_distinct_cities(db, s(i))),
+        "kitmdls": (lambda db, i: legacy_kitmdls(db, kitmfg), lambda db, i: crud.distinct_values(db, "kitmdl", kitmfg)),
+        "list_kits": (
+            lambda db, i: legacy_list_kits(db, kitmfg, s(i)),
+            lambda db, i: crud.list_kits(db, kitmfg=kitmfg, states=s(i), limit=20),
+        ),
+        "by_n_number": (lambda db, i: legacy_by_n_number(db, k(i)), lambda db, i: crud.kits_by_n_number(db, k(i))),
+    }
+
+def time_calls(Session, fn, calls: int) -> dict:
+    db = Session()
+    try:
+        for i in range(min(calls, 50)):   # warm the connection, caches and prepared statements
+            fn(db, i)
+        lat = []
+        for i in range(calls):
+            t0 = time.perf_counter()
+            fn(db, i)
+            lat.append((time.perf_counter() - t0) * 1e6)
+    finally:
+        db.close()
+    lat.sort()
+    return {
+        "mean_us": round(statistics.fmean(lat), 1),
+        "p50_us": round(lat[len(lat) // 2], 1),
+        "p95_us": round(lat[int(len(lat) * 0.95)], 1),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Microbenchmark crud statement caching.")
+    ap.add_argument("--calls", type=int, default=2000, help="calls per case and mode")
+    ap.add_argument("--out", help="write the JSON report here")
+    args = ap.parse_args()
+
+    legacy_args = {**connect_args, "prepare_threshold": None} if "prepare_threshold" in connect_args else connect_args
+    legacy = sessionmaker(bind=create_engine(DATABASE_URL, pool_size=1, connect_args=legacy_args))
+    cached = sessionmaker(bind=create_engine(DATABASE_URL, pool_size=1, connect_args=connect_args))
+
+    db = cached()
+    try:
+        scopes = [list(regions.canonical_states([r])) for r in regions.REGION_TO_STATES]
+        scopes += [["TX"], ["TX", "OK", "LA", "NM", "AR"]]
+        kitmfg = crud.count_by_kitmfg(db)[0][0]
+        sample = [k.n_number for k in crud.list_kits(db, kitmfg=kitmfg, limit=200)[1]]
+        keys = [sample[i:i + 20] for i in range(0, len(sample), 20)] or [[]]
+        state_scope = "literal ids" if crud.KITS_LAYOUT.get(db).partitioned else "array"
+    finally:
+        db.close()
+
+    report = {"calls": args.calls, "prepare_threshold": connect_args.get("prepare_threshold"),
+              "state_scope": state_scope, "cases": {}}
+    print(f"state-scoped cases send {state_scope}")
+    for name, (old, new) in cases(scopes, kitmfg, keys).items():
+        before = time_calls(legacy, old, args.calls)
+        after = time_calls(cached, new, args.calls)
+        sql = state_scope if name in STATE_SCOPED else "array" if name == "by_n_number" else "scalar"
+        report["cases"][name] = {"legacy": before, "cached": after, "sql": sql,
+                                 "speedup": round(before["mean_us"] / after["mean_us"], 2)}
+        print(f"{name:<15} legacy {before['mean_us']:>9} us  cached {after['mean_us']:>9} us  "
+              f"x{report['cases'][name]['speedup']}  ({sql})")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+if __name__ == "__main__":
+    main()
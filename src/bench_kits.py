@@ -0,0 +1,273 @@
+# src/bench_kits.py
+'''
+Reproducible benchmark of the whole pipeline at several registry sizes:
+
+  1. generate a synthetic registry (synth_kits) at each --scale
+  2. time prepare_kits and ingest_kits on it
+  3. hammer every /kits* endpoint at fixed --concurrency against the running API
+  4. write a JSON report for regression tracking
+
+Point DATABASE_URL at a local/throwaway Postgres (ingest replaces `kits`) and
+API_BASE at an API served from the same database.
+
+    python bench_kits.py --scale 1 10 --concurrency 8 --requests 300 --out bench_report.json
+
+--partitions instead re-ingests each scale once per kits layout (KITS_PARTITION)
+and times the region-scoped crud aggregates straight against Postgres; the API
+serves named regions from rollups, so this is the path custom state lists take.
+It also EXPLAINs the SQL crud sent for each scope and records which kits_fact
+partitions the plan still scans:
+
+    python bench_kits.py --scale 10 --partitions none state region --requests 50
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+import synth_kits
+import prepare_kits
+import regions
+
+API = os.getenv("API_BASE", "http://localhost:8000")
+BENCH_DIR = os.getenv("BENCH_DIR", "/app/data/bench")
+SAMPLE_STATES = "TX,OK,LA,NM,AR"
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def _timed(fn, *args, **kwargs) -> float:
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return round(time.perf_counter() - t0, 3)
+
+def endpoint_cases(session: requests.Session) -> dict[str, tuple[str, str, dict]]:
+    """name -> (method, path, params/body); sample values are taken from the loaded data."""
+    kitmfg = session.get(f"{API}/kits/agg/by_kitmfg", timeout=60).json()[0]["kitmfg"]
+    sample = session.get(f"{API}/kits", params={"kitmfg": kitmfg, "limit": 200}, timeout=60).json()
+    n_numbers = [r["n_number"] for r in sample]
+    mode_s = [r["mode_s_code"] for r in sample if r.get("mode_s_code")]
+    snapshots = session.get(f"{API}/kits/metrics/history", timeout=60).json()
+    as_of = {"as_of": snapshots[0]["snapshot_date"]} if snapshots else None
+    history = {
+        "kits_as_of": ("GET", "/kits", {**as_of, "kitmfg": kitmfg, "states": SAMPLE_STATES}),
+        "agg_by_kitmfg_as_of": ("GET", "/kits/agg/by_kitmfg", {**as_of, "region": "South"}),
+        "agg_by_state_as_of": ("GET", "/kits/agg/by_state", as_of),
+        "city_count_as_of": ("GET", "/kits/metrics/city_count", {**as_of, "states": SAMPLE_STATES}),
+    } if as_of else {}
+    return {
+        "kits": ("GET", "/kits", {}),
+        "kits_states": ("GET", "/kits", {"states": SAMPLE_STATES}),
+        "kits_kitmfg": ("GET", "/kits", {"kitmfg": kitmfg, "states": SAMPLE_STATES}),
+        "kits_mfr_free_text": ("GET", "/kits", {"mfr": sample[0]["mfr"]} if sample else {}),
+        "facets": ("GET", "/kits/facets", {"states": SAMPLE_STATES}),
+        "facets_kitmfg": ("GET", "/kits/facets", {"kitmfg": kitmfg}),
+        "filters_kitmfgs": ("GET", "/kits/filters/kitmfgs", {}),
+        "filters_kitmdls": ("GET", "/kits/filters/kitmdls", {"kitmfg": kitmfg}),
+        "filters_states": ("GET", "/kits/filters/states", {}),
+        "agg_by_kitmfg": ("GET", "/kits/agg/by_kitmfg", {}),
+        "agg_by_kitmfg_states": ("GET", "/kits/agg/by_kitmfg", {"states": SAMPLE_STATES}),
+        "agg_by_state": ("GET", "/kits/agg/by_state", {}),
+        "agg_by_engcat": ("GET", "/kits/agg/by_engcat", {"states": SAMPLE_STATES}),
+        "agg_timeseries": ("GET", "/kits/agg/timeseries", {"grain": "year", "by": "kitmfg"}),
+        "city_count": ("GET", "/kits/metrics/city_count", {"states": SAMPLE_STATES}),
+        "lookup_batch": ("POST", "/kits/lookup", {"n_numbers": n_numbers, "mode_s_codes": mode_s}),
+        **history,
+    }
+
+def run_endpoint(method: str, path: str, params: dict, n: int, concurrency: int) -> dict:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def one(_):
+        t0 = time.perf_counter()
+        if method == "POST":
+            r = session.post(f"{API}{path}", json=params, timeout=120)
+        else:
+            r = session.get(f"{API}{path}", params=params, timeout=120)
+        return time.perf_counter() - t0, r.status_code, len(r.content)
+
+    one(None)   # warm caches/connections
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        results = list(ex.map(one, range(n)))
+    wall = time.perf_counter() - t0
+
+    lat = sorted(r[0] * 1000 for r in results)
+    pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 2)
+    return {
+        "requests": n,
+        "errors": sum(1 for r in results if r[1] >= 400),
+        "rps": round(n / wall, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "mean_ms": round(statistics.fmean(lat), 2),
+        "bytes": results[-1][2],
+    }
+
+def wait_for_reload(timeout: float = 300):
+    """Ingest bumps kits_meta.loaded_at; wait until the API has rebuilt its indexes for it."""
+    import crud
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        loaded_at = crud.kits_version(db)
+    finally:
+        db.close()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            seen = requests.get(f"{API}/kits/metrics/facet_index", timeout=60).json()["loaded_at"]
+            if seen and datetime.fromisoformat(seen) == loaded_at:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise TimeoutError("API did not pick up the new load")
+
+def _prepare(scale: float, args, out: dict) -> str:
+    """Synthetic registry at `scale`, prepared; returns the parquet path for ingest."""
+    raw = os.path.join(BENCH_DIR, f"kits_raw_x{scale:g}.parquet")
+    prepared = os.path.join(BENCH_DIR, f"kits_prepared_x{scale:g}.parquet")
+    if not os.path.exists(raw) or args.regenerate:
+        df = synth_kits.generate(out["rows"], prepare_kits.read_source(args.seed_file), seed=args.seed)
+        out["generate_s"] = _timed(synth_kits.write, df, raw)
+    out["prepare_s"] = _timed(prepare_kits.main, raw, prepared)
+    return prepared
+
+def bench_scale(scale: float, args) -> dict:
+    rows = int(synth_kits.REAL_ROWS * scale)
+    out = {"scale": scale, "rows": rows}
+
+    if not args.skip_load:
+        import ingest_kits   # imports db, so only when we actually load
+
+        prepared = _prepare(scale, args, out)
+        out["ingest_s"] = _timed(ingest_kits.main, prepared)
+        out["prepare_rows_per_s"] = round(rows / out["prepare_s"])
+        out["ingest_rows_per_s"] = round(rows / out["ingest_s"])
+        wait_for_reload()
+
+    session = requests.Session()
+    out["endpoints"] = {}
+    for name, (method, path, params) in endpoint_cases(session).items():
+        out["endpoints"][name] = run_endpoint(method, path, params, args.requests, args.concurrency)
+        e = out["endpoints"][name]
+        print(f"  x{scale:g} {name:<22} p50 {e['p50_ms']:>8} ms  p99 {e['p99_ms']:>8} ms  {e['rps']:>8} rps")
+    return out
+
+def _relations(plan: dict) -> list[str]:
+    names = [plan["Relation Name"]] if "Relation Name" in plan else []
+    for child in plan.get("Plans", []):
+        names += _relations(child)
+    return names
+
+def explain_partitions(db, fn, states) -> list[str]:
+    """kits_fact partitions left in the plan of the statement fn sends (the crud SQL as executed)."""
+    from sqlalchemy import event
+
+    sent = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        sent.append((statement, parameters))
+    bind = db.get_bind()
+    event.listen(bind, "before_cursor_execute", capture)
+    try:
+        fn(db, states)
+    finally:
+        event.remove(bind, "before_cursor_execute", capture)
+    statement, parameters = sent[-1]
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+    return sorted({r for r in _relations(plan[0]["Plan"]) if r.startswith("kits_fact")})
+
+def bench_partitions(scale: float, args) -> dict:
+    """Ingest once per layout, then time crud.count_by_* per scope on the same data."""
+    import crud
+    import ingest_kits
+    from sqlalchemy import text
+    from db import SessionLocal
+
+    out = {"scale": scale, "rows": int(synth_kits.REAL_ROWS * scale), "layouts": {}}
+    prepared = _prepare(scale, args, out)
+    scopes = {name: list(regions.canonical_states([name])) for name in regions.REGION_TO_STATES}
+    scopes["All"] = None
+    scopes["sample_states"] = SAMPLE_STATES.split(",")
+    queries = {
+        "by_state": crud.count_by_state,
+        "by_kitmfg": crud.count_by_kitmfg,
+        "city_count": crud.count_distinct_cities,
+    }
+    for layout in args.partitions:
+        partition = "" if layout == "none" else layout
+        res = out["layouts"][layout] = {"ingest_s": _timed(ingest_kits.main, prepared, partition)}
+        db = SessionLocal()
+        try:
+            total = db.execute(text(
+                "SELECT count(*) FROM pg_partition_tree('kits_fact') WHERE isleaf;"
+            )).scalar()
+            res["partitions"] = total
+            for scope, states in scopes.items():
+                scanned = explain_partitions(db, crud.count_by_state, states)
+                res[f"plan:{scope}"] = scanned
+                print(f"  x{scale:g} {layout:<7} {scope:<14} scans {len(scanned)}/{total} partitions: {', '.join(scanned)}")
+            for qname, fn in queries.items():
+                for scope, states in scopes.items():
+                    fn(db, states)   # warm the buffer cache
+                    lat = sorted(_timed_ms(fn, db, states) for _ in range(args.requests))
+                    pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 2)
+                    res[f"{qname}:{scope}"] = {"p50_ms": pct(0.50), "p95_ms": pct(0.95), "mean_ms": round(statistics.fmean(lat), 2)}
+                    print(f"  x{scale:g} {layout:<7} {qname:<11} {scope:<14} p50 {pct(0.50):>8} ms  p95 {pct(0.95):>8} ms")
+        finally:
+            db.close()
+    return out
+
+def _timed_ms(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - t0) * 1000
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark prepare/ingest and the /kits API.")
+    ap.add_argument("--scale", type=float, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    ap.add_argument("--seed-file", default=os.environ.get("DATA_XLSX", "/app/data/demo.xlsx"))
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--regenerate", action="store_true", help="rebuild cached synthetic files")
+    ap.add_argument("--skip-load", action="store_true", help="benchmark the API on whatever is loaded")
+    ap.add_argument("--partitions", nargs="+", choices=["none", "state", "region"],
+                    help="compare kits layouts on region-scoped SQL aggregates instead of the API")
+    ap.add_argument("--out", default="bench_report.json")
+    args = ap.parse_args()
+
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_rev": _git_rev(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "api": API,
+        "concurrency": args.concurrency,
+        "requests_per_endpoint": args.requests,
+        "runs": [],
+    }
+    for scale in args.scale:
+        print(f"== scale x{scale:g}")
+        report["runs"].append(bench_partitions(scale, args) if args.partitions else bench_scale(scale, args))
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+if __name__ == "__main__":
+    main()
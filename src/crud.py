@@ -1,13 +1,142 @@
 # src/crud.py
+'''
+Statements are built once per shape (which optional filters are present) and
+cached; values always travel as bind parameters, with state/key lists bound as
+one array (`= ANY(:states)`) instead of a variable-length IN list. Every call
+with the same shape therefore sends identical SQL, which skips SQLAlchemy's
+statement construction and lets psycopg reuse a server-side prepared
+statement (see DB_PREPARE_THRESHOLD in db.py).
+
+The one exception is the state scope on a partitioned kits_fact: it is sent as
+a constant list of dim_state ids, because Postgres only prunes on constants
+(see in_states). Unpartitioned, it stays an array bind like everything else.
+'''
+from functools import lru_cache
+from typing import NamedTuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from models import Kit
+from datetime import date
+from sqlalchemy import func, literal_column, text, Date, ARRAY, String, any_, bindparam, select
+from models import Kit, KitsMeta, StateDim, KitHistory, KitSnapshot, TS_ROLLUPS
+import versioned
+
+DISTINCT_FIELDS = {
+    "mfr", "model", "state", "acftcat", "engcat", "surfcat",
+    "ac_weight", "city", "zip_min", "kitmfg", "kitmdl"
+}
+# Equality filters list_kits accepts, in the order they're applied
+LIST_FILTERS = ("kitmfg", "kitmdl", "engcat", "acftcat", "mfr", "model")
+
+def array_param(name: str):
+    return bindparam(name, type_=ARRAY(String))
+
+def in_states(param: str = "states"):
+    """
+    Kit.state IN (...) written as state_id IN (3, 7, 9), with the dim_state ids rendered
+    into the SQL (literal_execute). Postgres only prunes list partitions on a constant
+    list; a bound array or an array_agg subquery still scans every partition of kits_fact.
+    Callers bind `<param>_ids` via _bind_states.
+    """
+    return Kit.state_id.in_(bindparam(f"{param}_ids", literal_execute=True))
+
+@lru_cache(maxsize=None)
+def _state_ids_stmt(some: bool = False):
+    stmt = select(StateDim.value, StateDim.id)
+    return stmt.where(StateDim.value == any_(array_param("codes"))) if some else stmt
+
+class KitsLayout(NamedTuple):
+    partitioned: bool
+    state_ids: dict[str, int]
+    unknown: set[str]   # codes looked up since the build and not in dim_state
+
+    @classmethod
+    def build(cls, db: Session) -> "KitsLayout":
+        partitioned = db.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('kits_fact')")).scalar()
+        return cls(bool(partitioned), dict(db.execute(_state_ids_stmt()).all()), set())
+
+    def ids(self, db: Session, codes: list[str]) -> dict[str, int]:
+        """
+        state_ids, plus any of codes a load appended since the build. Ingest never renumbers
+        dim_state (see ingest_kits.dims_sql), so a cached id can't point at another state.
+        """
+        new = [s for s in codes if s not in self.state_ids and s not in self.unknown]
+        if new:
+            found = dict(db.execute(_state_ids_stmt(True), {"codes": new}).all())
+            self.state_ids.update(found)
+            self.unknown.update(s for s in new if s not in found)
+        return self.state_ids
+
+KITS_LAYOUT = versioned.Versioned("kits layout", KitsLayout.build)
+
+def _literal_states(db: Session, scoped: bool, history: bool) -> bool:
+    """Send this kits state scope as literal ids (see in_states)? Only pays off when partitioned."""
+    return scoped and not history and KITS_LAYOUT.get(db).partitioned
 
-def count_distinct_cities(db, states: list[str] | None = None) -> int:
-    q = db.query(func.count(func.distinct(Kit.city)))
-    if states:
-        q = q.filter(Kit.state.in_(states))
-    return q.scalar() or 0
+def _bind_states(db: Session, params: dict, literal: bool) -> dict:
+    """Swap the state codes for their dim_state ids when the statement uses in_states."""
+    if not literal:
+        return params
+    ids = KITS_LAYOUT.get(db).ids(db, [s for p in ("states", "state") for s in params.get(p, ())])
+    for p in ("states", "state"):
+        if p in params:
+            params[f"{p}_ids"] = [ids[s] for s in params.pop(p) if s in ids]
+    return params
+
+def valid_at(as_of):
+    """kits_history versions current on as_of; matches the GiST index on the same daterange."""
+    H = KitHistory
+    return func.daterange(H.valid_from, H.valid_to, literal_column("'[)'")).op("@>")(as_of)
+
+def _source(history: bool):
+    """Today's kits, or the kits_history versions valid on :as_of."""
+    return KitHistory if history else Kit
+
+def _scope(M, param: str = "states", literal: bool = False):
+    return in_states(param) if literal else M.state == any_(array_param(param))
+
+def _where(M, scoped: bool, history: bool, literal: bool = False) -> list:
+    conds = [valid_at(bindparam("as_of", type_=Date))] if history else []
+    if scoped:
+        conds.append(_scope(M, literal=literal))
+    return conds
+
+def _params(states: list[str] | None = None, as_of: date | None = None, **params) -> dict:
+    if states is not None:   # [] is a scope with no states -> no rows
+        params["states"] = [s.upper() for s in states]
+    if as_of is not None:
+        params["as_of"] = as_of
+    return params
+
+@lru_cache(maxsize=None)
+def _version_stmt():
+    return select(func.max(KitsMeta.loaded_at))
+
+def kits_version(db: Session):
+    """Timestamp of the last ingest (None if nothing has been loaded yet)."""
+    return db.execute(_version_stmt()).scalar()
+
+@lru_cache(maxsize=None)
+def _city_count_stmt(scoped: bool, history: bool, literal: bool = False):
+    M = _source(history)
+    return select(func.count(func.distinct(M.city))).where(*_where(M, scoped, history, literal))
+
+def count_distinct_cities(db, states: list[str] | None = None, as_of: date | None = None) -> int:
+    literal = _literal_states(db, states is not None, as_of is not None)
+    stmt = _city_count_stmt(states is not None, as_of is not None, literal)
+    return db.execute(stmt, _bind_states(db, _params(states, as_of), literal)).scalar() or 0
+
+@lru_cache(maxsize=256)
+def _list_stmts(filters: tuple[str, ...], state: bool, scoped: bool, history: bool, literal: bool = False):
+    M = _source(history)
+    conds = [getattr(M, f) == bindparam(f) for f in filters]
+    if state:
+        conds.append(_scope(M, "state", literal))
+    conds += _where(M, scoped, history, literal)
+    count = select(func.count()).select_from(M).where(*conds)
+    page = (
+        select(M).where(*conds).order_by(M.n_number)
+        .offset(bindparam("offset")).limit(bindparam("limit"))
+    )
+    return count, page
 
 def list_kits(
     db: Session,
@@ -18,81 +147,142 @@ def list_kits(
     states: list[str] | None = None,   # <- supports region scoping
     kitmfg: str | None = None,
     kitmdl: str | None = None,
+    engcat: str | None = None,
+    acftcat: str | None = None,
     limit: int = 100,
     offset: int = 0,
+    as_of: date | None = None,
 ):
-    q = db.query(Kit)
-
-    if kitmfg:
-        q = q.filter(Kit.kitmfg == kitmfg)
-    if kitmdl:
-        q = q.filter(Kit.kitmdl == kitmdl)
-    if mfr:
-        q = q.filter(Kit.mfr == mfr)
-    if model:
-        q = q.filter(Kit.model == model)
+    values = {"kitmfg": kitmfg, "kitmdl": kitmdl, "engcat": engcat, "acftcat": acftcat, "mfr": mfr, "model": model}
+    filters = tuple(f for f in LIST_FILTERS if values[f])
+    literal = _literal_states(db, bool(state) or states is not None, as_of is not None)
+    count, page = _list_stmts(filters, bool(state), states is not None, as_of is not None, literal)
+    params = _params(states, as_of, **{f: values[f] for f in filters})
     if state:
-        q = q.filter(Kit.state == state.upper())
-    if states:
-        q = q.filter(Kit.state.in_([s.upper() for s in states]))
+        params["state"] = [state.upper()]
+    _bind_states(db, params, literal)
 
-    total = q.count()
-    rows = q.order_by(Kit.n_number).offset(offset).limit(limit).all()
+    total = db.execute(count, params).scalar()
+    rows = db.execute(page, {**params, "limit": limit, "offset": offset}).scalars().all()
     return total, rows
 
+@lru_cache(maxsize=None)
+def _by_n_number_stmt():
+    return select(Kit).where(Kit.n_number == any_(array_param("keys"))).order_by(Kit.n_number)
+
+def kits_by_n_number(db: Session, keys: list[str]):
+    """Full rows for a page of n_numbers (facets.list_kits pages on bitmaps, then fetches here)."""
+    return db.execute(_by_n_number_stmt(), {"keys": list(keys)}).scalars().all()
+
+@lru_cache(maxsize=None)
+def _distinct_stmt(field: str, by_kitmfg: bool):
+    col = getattr(Kit, field)
+    stmt = select(col).where(col.isnot(None))
+    if by_kitmfg:
+        stmt = stmt.where(Kit.kitmfg == bindparam("kitmfg"))
+    return stmt.distinct().order_by(col)
+
 def distinct_values(db: Session, field: str, kitmfg: str | None = None) -> list[str]:
     """
     Generic distinct getter.
     If field == 'kitmdl' and kitmfg is provided, scope models to that manufacturer.
     """
-    allowed = {
-        "mfr", "model", "state", "acftcat", "engcat", "surfcat",
-        "ac_weight", "city", "zip_min", "kitmfg", "kitmdl"
-    }
-    if field not in allowed:
+    if field not in DISTINCT_FIELDS:
         raise ValueError(f"Unsupported field for distinct: {field}")
 
-    if field == "kitmdl" and kitmfg:
-        q = (
-            db.query(Kit.kitmdl)
-              .filter(Kit.kitmdl.isnot(None), Kit.kitmfg == kitmfg)
-              .distinct()
-              .order_by(Kit.kitmdl)
-        )
-        return [v for (v,) in q.all()]
+    by_kitmfg = field == "kitmdl" and bool(kitmfg)
+    params = {"kitmfg": kitmfg} if by_kitmfg else {}
+    return list(db.execute(_distinct_stmt(field, by_kitmfg), params).scalars())
 
-    col = getattr(Kit, field)
-    q = db.query(col).filter(col.isnot(None)).distinct().order_by(col)
-    return [v for (v,) in q.all()]
-
-def count_by_kitmfg(db: Session, states: list[str] | None = None):
-    q = db.query(Kit.kitmfg, func.count().label("cnt"))
-    if states:
-        q = q.filter(Kit.state.in_([s.upper() for s in states]))
-    return (
-        q.group_by(Kit.kitmfg)
-         .order_by(func.count().desc())
-         .all()
-    )
+@lru_cache(maxsize=None)
+def _count_by_stmt(field: str, scoped: bool, history: bool, literal: bool = False):
+    M = _source(history)
+    col = getattr(M, field)
+    stmt = select(col, func.count().label("cnt")).where(*_where(M, scoped, history, literal))
+    if field == "engcat":
+        stmt = stmt.where(col.isnot(None), col != "")
+    return stmt.group_by(col).order_by(func.count().desc())
+
+def _count_by(db: Session, field: str, states: list[str] | None, as_of: date | None):
+    literal = _literal_states(db, states is not None, as_of is not None)
+    stmt = _count_by_stmt(field, states is not None, as_of is not None, literal)
+    return db.execute(stmt, _bind_states(db, _params(states, as_of), literal)).all()
+
+def count_by_kitmfg(db: Session, states: list[str] | None = None, as_of: date | None = None):
+    return _count_by(db, "kitmfg", states, as_of)
 
-def count_by_state(db: Session, states: list[str] | None = None):
+def count_by_state(db: Session, states: list[str] | None = None, as_of: date | None = None):
     """
     Return (state, count) pairs; optionally scoped to a list of state codes.
     """
-    q = db.query(Kit.state, func.count().label("cnt"))
-    if states:
-        q = q.filter(Kit.state.in_([s.upper() for s in states]))
-    return (
-        q.group_by(Kit.state)
-         .order_by(func.count().desc())
-         .all()
-    )
+    return _count_by(db, "state", states, as_of)
+
+def count_by_engcat(db, states: list[str] | None=None, as_of: date | None = None):
+    return _count_by(db, "engcat", states, as_of)
+
+# timeseries filter -> the rollup column it needs
+TS_FILTER_COLUMNS = {"states": "state", "kitmfg": "kitmfg", "engcat": "engcat"}
+
+def _timeseries_source(by: str | None, filters: tuple[str, ...]):
+    """Smallest rollup with the `by` column and every filtered column."""
+    need = {TS_FILTER_COLUMNS[f] for f in filters if f in TS_FILTER_COLUMNS}
+    if by:
+        need.add(by)
+    return next(t for cols, t in TS_ROLLUPS.items() if need <= set(cols))
+
+@lru_cache(maxsize=256)
+def _timeseries_stmt(yearly: bool, by: str | None, filters: tuple[str, ...]):
+    R = _timeseries_source(by, filters).c
+    if yearly:
+        # literal (not a bind param) so GROUP BY/ORDER BY match the select expression
+        period = func.date_trunc(literal_column("'year'"), R.period).cast(Date)
+    else:
+        period = R.period
+
+    cols = [period.label("period")]
+    if by:
+        cols.append(R[by].label(by))
+    stmt = select(*cols, func.sum(R.cnt).label("cnt")).where(R.date_field == bindparam("field"))
+
+    conds = {
+        "start": lambda: R.period >= bindparam("start", type_=Date),
+        "end": lambda: R.period <= bindparam("end", type_=Date),
+        "states": lambda: R.state == any_(array_param("states")),
+        "kitmfg": lambda: R.kitmfg == bindparam("kitmfg"),
+        "engcat": lambda: R.engcat == bindparam("engcat"),
+    }
+    stmt = stmt.where(*(conds[f]() for f in filters))
+    return stmt.group_by(*cols).order_by(period)
+
+def timeseries(
+    db: Session,
+    *,
+    field: str = "cert_issue_date",
+    grain: str = "month",
+    by: str | None = None,
+    states: list[str] | None = None,
+    kitmfg: str | None = None,
+    engcat: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
+):
+    """
+    Registrations per period from the smallest kits_ts_* rollup that can answer it.
+    Returns (period, count) or (period, by_value, count) rows ordered by period.
+    """
+    yearly = grain == "year" or field == "year_mfr"
+    # Whole buckets at both edges: rows carry the first day of their month, so a monthly
+    # end already covers its month; a yearly one must reach the last month of its year
+    if start:
+        start = start.replace(month=1, day=1) if yearly else start.replace(day=1)
+    if end and yearly:
+        end = end.replace(month=12, day=31)
 
-def count_by_engcat(db, states: list[str] | None=None):
-    q = db.query(Kit.engcat, func.count()).filter(Kit.engcat.isnot(None), Kit.engcat != "")
-    if states:
-        q = q.filter(Kit.state.in_(states))
-    return (
-        q.group_by(Kit.engcat).order_by(func.count().desc()).all()
+    params = _params(states, start=start, end=end, kitmfg=kitmfg, engcat=engcat)
+    params = {k: v for k, v in params.items() if k == "states" or v}
+    stmt = _timeseries_stmt(yearly, by, tuple(sorted(params)))
+    return db.execute(stmt, {**params, "field": field}).all()
 
-    )
\ No newline at end of file
+def snapshots(db: Session):
+    """Ingested snapshot dates with their delta sizes and kits_history growth, oldest first."""
+    return db.query(KitSnapshot).order_by(KitSnapshot.snapshot_date).all()
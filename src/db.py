@@ -10,8 +10,28 @@ DATABASE_URL = os.getenv("DATABASE_URL")  # e.g. postgresql+psycopg://user:pw@po
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is not set")
 
+# Pool size is per process: with N API workers Postgres sees up to N * (size + overflow) connections
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# psycopg 3 prepares a statement server-side once the same SQL text has run this many times
+# on a connection (crud keeps SQL text stable per shape). "off" disables it, e.g. behind
+# pgbouncer in transaction mode.
+PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "1")
+connect_args = {}
+if DATABASE_URL.startswith("postgresql+psycopg:"):
+    connect_args["prepare_threshold"] = None if PREPARE_THRESHOLD == "off" else int(PREPARE_THRESHOLD)
+
 # Single shared engine for the app
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    connect_args=connect_args,
+)
 
 # Session factory (use Depends in FastAPI handlers)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
\ No newline at end of file
@@ -0,0 +1,128 @@
+# src/facets.py
+'''
+In-memory facet index for the low-cardinality columns the app filters on
+(state, kitmfg, kitmdl, engcat, acftcat). Every row of `kits` gets a position
+(ordered by n_number) and every facet value keeps a roaring bitmap of the
+positions that carry it, so filters become bitmap AND/OR and counts become
+popcounts instead of SQL scans.
+
+The index is rebuilt whenever ingest stamps a new `kits_meta.loaded_at`.
+'''
+from pyroaring import BitMap
+from sqlalchemy.orm import Session
+from models import Kit
+import crud
+from versioned import Versioned
+
+FACETS = ("state", "kitmfg", "kitmdl", "engcat", "acftcat")
+
+class FacetIndex:
+    def __init__(self, keys: list[str], columns: dict[str, list]):
+        self.keys = keys            # row position -> n_number
+        self.bitmaps: dict[str, dict[str | None, BitMap]] = {}
+
+        for facet in FACETS:
+            positions: dict[str | None, list[int]] = {}
+            for i, v in enumerate(columns[facet]):
+                positions.setdefault(v, []).append(i)
+            bitmaps = {}
+            for v, pos in positions.items():
+                bm = BitMap(pos)
+                bm.run_optimize()
+                bitmaps[v] = bm
+            self.bitmaps[facet] = bitmaps
+
+    @classmethod
+    def build(cls, db: Session) -> "FacetIndex":
+        cols = [getattr(Kit, f) for f in FACETS]
+        rows = db.query(Kit.n_number, *cols).order_by(Kit.n_number).all()
+        keys = [r[0] for r in rows]
+        columns = {f: [r[i + 1] for r in rows] for i, f in enumerate(FACETS)}
+        return cls(keys, columns)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def mask(self, filters: dict[str, list[str]], skip: str | None = None) -> BitMap | None:
+        """
+        AND across facets, OR within a facet's value list.
+        Returns None when nothing filters (i.e. every row matches).
+        """
+        out = None
+        for facet, values in filters.items():
+            if facet == skip or values is None:
+                continue
+            bitmaps = self.bitmaps[facet]
+            bm = BitMap.union(BitMap(), *[bitmaps[v] for v in values if v in bitmaps])
+            out = bm if out is None else out & bm
+        return out
+
+    def count(self, mask: BitMap | None) -> int:
+        return len(self.keys) if mask is None else len(mask)
+
+    def counts(self, facet: str, mask: BitMap | None = None) -> list[tuple[str | None, int]]:
+        """(value, count) pairs for one facet under a mask, largest first, zeros dropped."""
+        out = []
+        for v, bm in self.bitmaps[facet].items():
+            c = len(bm) if mask is None else bm.intersection_cardinality(mask)
+            if c:
+                out.append((v, c))
+        out.sort(key=lambda vc: vc[1], reverse=True)
+        return out
+
+    def page(self, mask: BitMap | None, offset: int, limit: int) -> list[str]:
+        """n_numbers of the matching rows in n_number order."""
+        if mask is None:
+            return self.keys[offset:offset + limit]
+        return [self.keys[i] for i in mask[offset:offset + limit]]
+
+    def memory_usage(self) -> dict:
+        """Serialized roaring size per facet (a close proxy for resident size)."""
+        report = {}
+        for facet, bitmaps in self.bitmaps.items():
+            report[facet] = {
+                "values": len(bitmaps),
+                "bytes": sum(len(bm.serialize()) for bm in bitmaps.values()),
+            }
+        return report
+
+FACET_INDEX = Versioned("facet index", FacetIndex.build)
+
+def get_index(db: Session) -> FacetIndex:
+    """Return the shared index, rebuilding it if ingest has loaded new data."""
+    return FACET_INDEX.get(db)
+
+def normalize_filters(**filters: list[str] | None) -> dict[str, list[str]]:
+    out = {f: v for f, v in filters.items() if v is not None}
+    if "state" in out:
+        out["state"] = [s.upper() for s in out["state"]]
+    return out
+
+# ---------- crud-shaped helpers used by main.py ----------
+
+def list_kits(db: Session, *, filters: dict[str, list[str]], limit: int = 100, offset: int = 0):
+    """Same contract as crud.list_kits, but the filtering/paging is done on bitmaps."""
+    index = get_index(db)
+    mask = index.mask(filters)
+    keys = index.page(mask, offset, limit)
+    rows = crud.kits_by_n_number(db, keys) if keys else []
+    return index.count(mask), rows
+
+def facet_counts(db: Session, filters: dict[str, list[str]]) -> dict:
+    """
+    Drill-down counts for every facet under the current filters. Each facet
+    ignores its own filter (standard faceted search), so a selected kitmfg
+    still shows its sibling manufacturers with their counts.
+    """
+    index = get_index(db)
+    return {
+        "total": index.count(index.mask(filters)),
+        "facets": {
+            facet: [{"value": v, "count": c} for v, c in index.counts(facet, index.mask(filters, skip=facet))]
+            for facet in FACETS
+        },
+    }
+
+def count_by(db: Session, facet: str, states: list[str] | None = None):
+    index = get_index(db)
+    return index.counts(facet, index.mask(normalize_filters(state=states)))
@@ -1,31 +1,105 @@
 # src/ingest_kits.py
 import os
+from datetime import date
 import pandas as pd
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
 from db import engine
+from models import KitsMeta, KitHistory, KitSnapshot, TS_ROLLUPS
+import profiling
+import regions
+import warmup
 
 # PARQUET_PATH = "/app/data/processed/kits_prepared.parquet"
 PARQUET_PATH = os.getenv("DATA_OUT", "/app/data/processed/kits_prepared.parquet")
 
+def exec_script(conn, sql: str):
+    for stmt in sql.strip().split(";"):
+        s = stmt.strip()
+        if s:
+            conn.execute(text(s + ";"))
+
+def run_sql(engine: Engine, sql: str):
+    """Execute a ;-separated script in one transaction."""
+    with engine.begin() as conn:
+        exec_script(conn, sql)
+
 def load_raw(engine: Engine, path: str):
     if not os.path.exists(path):
         raise FileNotFoundError(f"Could not find {path} inside container.")
-    df = pd.read_parquet(path)
+    with profiling.stage("read_parquet") as st:
+        df = pd.read_parquet(path)
+        st["rows"] = len(df)
     print(f"Read {len(df):,} rows and {len(df.columns)} cols from {path}")
 
     # Re-create kits_raw from parquet
-    with engine.begin() as conn:
-        conn.execute(text("DROP TABLE IF EXISTS kits_raw CASCADE;"))
-    df.to_sql("kits_raw", engine, if_exists="replace", index=False, method="multi", chunksize=1000)
+    with profiling.stage("to_sql_kits_raw") as st:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS kits_raw CASCADE;"))
+        df.to_sql("kits_raw", engine, if_exists="replace", index=False, method="multi", chunksize=1000)
+        st["rows"] = len(df)
     print("Wrote to kits_raw")
+    return len(df)
+
+# Low-cardinality text columns stored as integer keys into dim_<col>(id, value)
+DIM_COLUMNS = {
+    "state": "smallint", "engcat": "smallint", "acftcat": "smallint",
+    "surfcat": "smallint", "ac_weight": "smallint",
+    "kitmfg": "integer", "kitmdl": "integer", "mfr": "integer", "model": "integer",
+}
+# Same index set as the old text table, on the keys instead
+INDEXED = ["mfr", "model", "state", "acftcat", "engcat"]
+# Opt-in: building the old index set on the staging table just to size it costs an extra indexing pass
+SIZE_REPORT = os.getenv("CURATED_SIZE_REPORT", "0") == "1"
+# "" = one heap, "state" = a list partition per state, "region" = per regions.partition_groups()
+PARTITION = os.getenv("KITS_PARTITION", "")
+# Date the loaded file describes (YYYY-MM-DD); defaults to today. HISTORY=0 skips kits_history.
+SNAPSHOT_DATE = os.getenv("SNAPSHOT_DATE")
+HISTORY = os.getenv("HISTORY", "1") == "1"
+# ANALYZE, prewarm and replay the dashboard queries after a load (see warmup.py)
+WARMUP = os.getenv("INGEST_WARMUP", "1") == "1"
+
+def drop_kits(conn):
+    """`kits` is a view over kits_fact now, but older loads (and create_all) left a table."""
+    kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('kits');")).scalar()
+    if kind == "v":
+        conn.execute(text("DROP VIEW kits;"))
+    elif kind is not None:
+        conn.execute(text("DROP TABLE kits CASCADE;"))
+
+def relation_sizes(conn, *tables: str) -> dict:
+    heap = idx = 0
+    for t in tables:
+        # pg_partition_tree is just the table itself when it isn't partitioned
+        h, i = conn.execute(text(
+            "SELECT sum(pg_relation_size(relid)), sum(pg_indexes_size(relid)) FROM pg_partition_tree(CAST(:t AS regclass));"
+        ), {"t": t}).one()
+        heap, idx = heap + h, idx + i
+    return {"heap_mb": round(heap / 2**20, 2), "index_mb": round(idx / 2**20, 2), "total_mb": round((heap + idx) / 2**20, 2)}
+
+def partition_sql(conn, partition: str) -> str:
+    """PARTITION OF kits_fact DDL for each state group; needs dim_state filled in."""
+    ids = dict(conn.execute(text("SELECT value, id FROM dim_state;")).all())
+    if partition == "state":
+        groups = {s.lower(): [s] for s in ids if s.isalpha()}
+    elif partition == "region":
+        groups = regions.partition_groups()
+    else:
+        raise ValueError(f"Unknown KITS_PARTITION: {partition} (expected state or region)")
+    ddl = ""
+    for name, states in groups.items():
+        keys = [str(ids[s]) for s in states if s in ids]
+        if keys:
+            ddl += f"CREATE TABLE kits_fact_{name} PARTITION OF kits_fact FOR VALUES IN ({', '.join(keys)});"
+    # NULL/unknown states and anything outside the named regions
+    return ddl + "CREATE TABLE kits_fact_default PARTITION OF kits_fact DEFAULT;"
 
-def create_curated_table(engine: Engine):
-    # src/ingest_kits.py (only the SQL block shown)
-    curated_sql = """
-    DROP TABLE IF EXISTS kits;
+def create_curated_table(engine: Engine, partition: str = PARTITION):
+    # Typed/cleaned copy of kits_raw; staging only, encoded into kits_fact below
+    wide_sql = """
+    DROP TABLE IF EXISTS kits_wide;
 
-    CREATE TABLE kits AS
+    CREATE TABLE kits_wide AS
     SELECT
     k.n_number::text               AS n_number,
     k.serial_number::text          AS serial_number,
@@ -58,25 +132,285 @@ def create_curated_table(engine: Engine):
 
     FROM kits_raw k;
 
-    ALTER TABLE kits ADD COLUMN id bigserial PRIMARY KEY;
+    ALTER TABLE kits_wide ADD COLUMN id bigserial PRIMARY KEY
+    """
+    # What the old text-column table cost, for the before/after report
+    wide_index_sql = "".join(
+        f"CREATE INDEX ON kits_wide ({c});" for c in [*INDEXED, "year_mfr"]
+    )
+
+    dims_sql = "".join(
+        f"DROP TABLE IF EXISTS dim_{c} CASCADE;"
+        f"CREATE TABLE dim_{c} (id {t} PRIMARY KEY, value text NOT NULL UNIQUE);"
+        f"INSERT INTO dim_{c} SELECT row_number() OVER (ORDER BY v), v"
+        f" FROM (SELECT DISTINCT {c} AS v FROM kits_wide WHERE {c} IS NOT NULL) d;"
+        for c, t in DIM_COLUMNS.items() if c != "state"
+    )
+    # dim_state is never renumbered, only appended to: the API caches code -> id and sends
+    # ids as literals (crud.in_states), so an id must keep meaning the same state across loads
+    dims_sql += """
+    CREATE TABLE IF NOT EXISTS dim_state (id smallint PRIMARY KEY, value text NOT NULL UNIQUE);
+    INSERT INTO dim_state
+    SELECT (SELECT coalesce(max(id), 0) FROM dim_state) + row_number() OVER (ORDER BY v), v
+    FROM (SELECT state FROM kits_wide WHERE state IS NOT NULL EXCEPT SELECT value FROM dim_state) d (v);
+    """
+
+    # 8-byte, 4-byte, then 2-byte columns ahead of the text ones keeps rows free of alignment padding
+    ints = [c for c, t in DIM_COLUMNS.items() if t == "integer"]
+    smalls = [c for c, t in DIM_COLUMNS.items() if t == "smallint"]
+    fact_joins = " ".join(f"LEFT JOIN dim_{c} d_{c} ON d_{c}.value = w.{c}" for c in ints + smalls)
+    fact_indexes = "".join(f"CREATE INDEX idx_kits_fact_{c}_id ON kits_fact ({c}_id);" for c in INDEXED)
+    # A partitioned table's primary key must include state_id, which can be NULL
+    id_key, partition_by = ("", " PARTITION BY LIST (state_id)") if partition else (" PRIMARY KEY", "")
+    fact_table_sql = f"""
+    DROP TABLE IF EXISTS kits_fact CASCADE;
+
+    CREATE TABLE kits_fact (
+    id               bigint{id_key},
+    year_mfr         integer,
+    no_seats         integer,
+    no_eng           integer,
+    {" ".join(c + "_id integer," for c in ints)}
+    last_action_date date,
+    cert_issue_date  date,
+    air_worth_date   date,
+    {" ".join(c + "_id smallint," for c in smalls)}
+    n_number         text,
+    serial_number    text,
+    mfr_mdl_code     text,
+    city             text,
+    zip_min          text,
+    mode_s_code      text
+    ){partition_by}
+    """
+    fact_sql = f"""
+    INSERT INTO kits_fact
+    SELECT w.id, w.year_mfr, w.no_seats, w.no_eng,
+           {", ".join("d_" + c + ".id" for c in ints)},
+           w.last_action_date, w.cert_issue_date, w.air_worth_date,
+           {", ".join("d_" + c + ".id" for c in smalls)},
+           w.n_number, w.serial_number, w.mfr_mdl_code, w.city, w.zip_min, w.mode_s_code
+    FROM kits_wide w
+    {fact_joins};
+
+    {fact_indexes}
+    CREATE INDEX idx_kits_fact_year_mfr ON kits_fact (year_mfr);
+    -- /kits pages on the facet bitmaps, then fetches the page by n_number (crud.kits_by_n_number)
+    CREATE INDEX idx_kits_fact_n_number ON kits_fact (n_number);
+    {"CREATE INDEX idx_kits_fact_id ON kits_fact (id);" if partition else ""}
+    ANALYZE kits_fact
+    """
+
+    view_joins = " ".join(f"LEFT JOIN dim_{c} d_{c} ON d_{c}.id = f.{c}_id" for c in DIM_COLUMNS)
+    # Today's column names for crud/ORM. LEFT JOINs on unique keys are dropped by the
+    # planner when a query doesn't read that column, so GROUP BY state only touches dim_state.
+    view_sql = f"""
+    CREATE VIEW kits AS
+    SELECT f.id, f.state_id, f.n_number, f.serial_number, f.mfr_mdl_code,
+           d_mfr.value AS mfr, d_model.value AS model, d_acftcat.value AS acftcat,
+           d_ac_weight.value AS ac_weight, d_engcat.value AS engcat, d_surfcat.value AS surfcat,
+           d_kitmfg.value AS kitmfg, d_kitmdl.value AS kitmdl,
+           f.no_seats, f.no_eng, f.city, d_state.value AS state, f.zip_min, f.mode_s_code,
+           f.year_mfr, f.last_action_date, f.cert_issue_date, f.air_worth_date
+    FROM kits_fact f
+    {view_joins}
+    """
+
+    # One transaction, like the old DROP + CTAS: readers never see kits missing
+    with engine.begin() as conn:
+        with profiling.stage("curated_ctas"):
+            exec_script(conn, wide_sql)
+            before = None
+            if SIZE_REPORT:
+                exec_script(conn, wide_index_sql)
+                before = relation_sizes(conn, "kits_wide")
+        with profiling.stage("dictionary_encode") as st:
+            drop_kits(conn)
+            exec_script(conn, dims_sql)
+            exec_script(conn, fact_table_sql)
+            if partition:
+                exec_script(conn, partition_sql(conn, partition))
+            exec_script(conn, fact_sql)
+            exec_script(conn, view_sql)
+            after = relation_sizes(conn, "kits_fact", *(f"dim_{c}" for c in DIM_COLUMNS))
+            st["rows"] = conn.execute(text("SELECT count(*) FROM kits_fact;")).scalar()
+            st["size_before"], st["size_after"] = before, after
+            st["partition"] = partition or None
+            conn.execute(text("DROP TABLE kits_wide;"))
+    if before:
+        print(f"kits size: {before['total_mb']} MB (heap {before['heap_mb']}, indexes {before['index_mb']}) "
+              f"-> {after['total_mb']} MB (heap {after['heap_mb']}, indexes {after['index_mb']}) dictionary-encoded")
+    print("Built curated kits view over kits_fact + dim_* tables")
+
+def create_rollups(engine: Engine):
+    # Registrations per month by kitmfg/state/engcat, so /kits/agg/timeseries never scans kits
+    rollup_sql = """
+    DROP TABLE IF EXISTS kits_ts_monthly;
+
+    CREATE TABLE kits_ts_monthly AS
+    SELECT 'cert_issue_date'::text AS date_field,
+           date_trunc('month', cert_issue_date)::date AS period,
+           kitmfg, state, engcat, count(*)::int AS cnt
+    FROM kits WHERE cert_issue_date IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+    UNION ALL
+    SELECT 'air_worth_date', date_trunc('month', air_worth_date)::date,
+           kitmfg, state, engcat, count(*)::int
+    FROM kits WHERE air_worth_date IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5
+    UNION ALL
+    SELECT 'year_mfr', make_date(year_mfr, 1, 1),
+           kitmfg, state, engcat, count(*)::int
+    FROM kits WHERE year_mfr IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5;
+
+    CREATE INDEX idx_kits_ts_state ON kits_ts_monthly (date_field, state);
+    CREATE INDEX idx_kits_ts_kitmfg ON kits_ts_monthly (date_field, kitmfg);
+    ANALYZE kits_ts_monthly;
+    """
+    # The cube is close to one row per registration; most queries group or filter on at
+    # most one column, so they read these much smaller sums of it instead
+    coarse = {t.name: cols for cols, t in TS_ROLLUPS.items() if t.name != "kits_ts_monthly"}
+    coarse_sql = "".join(
+        f"DROP TABLE IF EXISTS {name};"
+        f"CREATE TABLE {name} AS SELECT date_field, period, {''.join(c + ', ' for c in cols)}sum(cnt)::int AS cnt"
+        f" FROM kits_ts_monthly GROUP BY {', '.join(['date_field', 'period', *cols])};"
+        f"CREATE INDEX idx_{name} ON {name} (date_field, {''.join(c + ', ' for c in cols)}period);"
+        f"ANALYZE {name};"
+        for name, cols in coarse.items()
+    )
+    with profiling.stage("timeseries_rollup") as st:
+        with engine.begin() as conn:
+            exec_script(conn, rollup_sql)
+            exec_script(conn, coarse_sql)
+            st["table_rows"] = {
+                t.name: conn.execute(text(f"SELECT count(*) FROM {t.name};")).scalar() for t in TS_ROLLUPS.values()
+            }
+    print("Built timeseries rollups: " + ", ".join(f"{n} {r:,} rows" for n, r in st["table_rows"].items()))
+
+def create_region_rollups(engine: Engine):
+    # Facet counts per region scope, so region-scoped dashboards are lookups (see regions.py)
+    with profiling.stage("region_rollups") as st:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS kits_region_rollup;"))
+            conn.execute(text(
+                "CREATE TABLE kits_region_rollup ("
+                " region_key text NOT NULL, facet text NOT NULL, value text, cnt integer NOT NULL);"
+            ))
+            scopes = regions.rollup_scopes()
+            for key, states in scopes.items():
+                where = "" if states is None else "WHERE state = ANY(:states)"
+                params = {"key": key, "states": list(states or [])}
+                for facet in regions.ROLLUP_FACETS:
+                    conn.execute(text(
+                        f"INSERT INTO kits_region_rollup "
+                        f"SELECT :key, '{facet}', {facet}, count(*) FROM kits {where} GROUP BY {facet};"
+                    ), params)
+                conn.execute(text(
+                    f"INSERT INTO kits_region_rollup "
+                    f"SELECT :key, 'city_count', NULL, count(DISTINCT city) FROM kits {where};"
+                ), params)
+            conn.execute(text("CREATE INDEX idx_kits_region_rollup ON kits_region_rollup (region_key, facet);"))
+        st["rows"] = len(scopes)
+    print(f"Built kits_region_rollup for {len(scopes)} scopes")
+
+HISTORY_COLUMNS = [
+    "serial_number", "mfr_mdl_code", "mfr", "model", "acftcat", "no_seats", "ac_weight", "engcat",
+    "surfcat", "no_eng", "city", "state", "zip_min", "kitmfg", "kitmdl", "mode_s_code",
+    "year_mfr", "last_action_date", "cert_issue_date", "air_worth_date",
+]
 
-    CREATE INDEX IF NOT EXISTS idx_kits_mfr      ON kits (mfr);
-    CREATE INDEX IF NOT EXISTS idx_kits_model    ON kits (model);
-    CREATE INDEX IF NOT EXISTS idx_kits_state    ON kits (state);
-    CREATE INDEX IF NOT EXISTS idx_kits_acftcat  ON kits (acftcat);
-    CREATE INDEX IF NOT EXISTS idx_kits_engcat   ON kits (engcat);
-    CREATE INDEX IF NOT EXISTS idx_kits_year_mfr ON kits (year_mfr);
+def check_snapshot_date(conn, snapshot_date: str | date | None = SNAPSHOT_DATE) -> date:
+    """Resolve the snapshot date (default today); refuse one older than the latest snapshot."""
+    KitSnapshot.__table__.create(conn, checkfirst=True)
+    d = conn.execute(text("SELECT COALESCE(CAST(:d AS date), current_date);"), {"d": snapshot_date}).scalar()
+    # Not max(valid_from): a snapshot that only closed versions leaves its date in valid_to alone
+    latest = conn.execute(text("SELECT max(snapshot_date) FROM kits_snapshots;")).scalar()
+    if latest and d < latest:
+        raise ValueError(f"Snapshot date {d} is before the latest snapshot in kits_snapshots ({latest})")
+    return d
+
+def snapshot_history(engine: Engine, snapshot_date: str | date | None = SNAPSHOT_DATE):
+    """
+    Fold the freshly loaded kits into kits_history as a delta: versions whose row
+    changed or disappeared get valid_to = snapshot date, new/changed rows open a
+    version at it. Unchanged registrations cost nothing. Re-running a date replaces it.
     """
+    cols = ", ".join(HISTORY_COLUMNS)
+    KitHistory.__table__.create(engine, checkfirst=True)
+    with profiling.stage("history_delta") as st, engine.begin() as conn:
+        d = check_snapshot_date(conn, snapshot_date)
+        exec_script(conn, """
+        CREATE INDEX IF NOT EXISTS idx_kits_history_valid ON kits_history
+            USING gist (daterange(valid_from, valid_to, '[)'));
+        CREATE INDEX IF NOT EXISTS idx_kits_history_current ON kits_history (n_number) WHERE valid_to IS NULL
+        """)
+        # Same date again: drop what that run opened and reopen what it closed
+        conn.execute(text("DELETE FROM kits_history WHERE valid_from = :d;"), {"d": d})
+        conn.execute(text("UPDATE kits_history SET valid_to = NULL WHERE valid_to = :d;"), {"d": d})
+
+        conn.execute(text(f"""
+            CREATE TEMP TABLE kits_cur ON COMMIT DROP AS
+            SELECT n_number, md5(ROW({cols})::text) AS row_hash, {cols}
+            FROM kits WHERE n_number IS NOT NULL;
+        """))
+        conn.execute(text("CREATE INDEX ON kits_cur (n_number, row_hash);"))
+        conn.execute(text("ANALYZE kits_cur;"))
+        closed = conn.execute(text("""
+            UPDATE kits_history h SET valid_to = :d
+            WHERE h.valid_to IS NULL AND NOT EXISTS (
+                SELECT 1 FROM kits_cur c WHERE c.n_number = h.n_number AND c.row_hash = h.row_hash);
+        """), {"d": d}).rowcount
+        added = conn.execute(text(f"""
+            INSERT INTO kits_history (n_number, valid_from, valid_to, row_hash, {cols})
+            SELECT c.n_number, :d, NULL, c.row_hash, {", ".join("c." + c for c in HISTORY_COLUMNS)}
+            FROM kits_cur c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM kits_history h
+                WHERE h.n_number = c.n_number AND h.valid_to IS NULL AND h.row_hash = c.row_hash);
+        """), {"d": d}).rowcount
+        conn.execute(text("ANALYZE kits_history;"))
+
+        rows, history_rows, history_bytes = conn.execute(text("""
+            SELECT (SELECT count(*) FROM kits_cur), (SELECT count(*) FROM kits_history),
+                   pg_total_relation_size('kits_history');
+        """)).one()
+        conn.execute(text("DELETE FROM kits_snapshots WHERE snapshot_date = :d;"), {"d": d})
+        conn.execute(text("""
+            INSERT INTO kits_snapshots (snapshot_date, rows, added, closed, history_rows, history_bytes, loaded_at)
+            VALUES (:d, :rows, :added, :closed, :hrows, :hbytes, now());
+        """), {"d": d, "rows": rows, "added": added, "closed": closed, "hrows": history_rows, "hbytes": history_bytes})
+        st.update(rows=rows, snapshot_date=d, added=added, closed=closed, history_mb=round(history_bytes / 2**20, 2))
+    print(f"Snapshot {d}: +{added:,} / -{closed:,} versions, kits_history {history_rows:,} rows, "
+          f"{history_bytes / 2**20:.1f} MB")
+
+def mark_loaded(engine: Engine):
+    # Bumping loaded_at tells running API workers to rebuild their in-memory indexes
+    KitsMeta.__table__.create(engine, checkfirst=True)
     with engine.begin() as conn:
-        for stmt in curated_sql.strip().split(";"):
-            s = stmt.strip()
-            if s:
-                conn.execute(text(s + ";"))
-    print("Built curated kits table")
-
-def main():
-    load_raw(engine, PARQUET_PATH)
-    create_curated_table(engine)
+        conn.execute(text("DELETE FROM kits_meta;"))
+        conn.execute(text("INSERT INTO kits_meta (loaded_at) VALUES (now());"))
+    print("Stamped kits_meta.loaded_at")
+
+def main(path: str = PARQUET_PATH, partition: str = PARTITION):
+    with profiling.run("ingest", src=path, partition=partition or None) as report:
+        snapshot_date = None
+        if HISTORY:
+            # Before anything replaces kits: an out-of-order file must not overwrite a newer load
+            with engine.begin() as conn:
+                snapshot_date = check_snapshot_date(conn)
+            report["meta"]["snapshot_date"] = snapshot_date
+        report["meta"]["rows"] = load_raw(engine, path)
+        create_curated_table(engine, partition)
+        create_rollups(engine)
+        create_region_rollups(engine)
+        if HISTORY:
+            snapshot_history(engine, snapshot_date)
+        mark_loaded(engine)
+        if WARMUP:
+            with profiling.run("warmup"):
+                warmup.run(engine, ["kits_fact", *(f"dim_{c}" for c in DIM_COLUMNS),
+                                    *(t.name for t in TS_ROLLUPS.values()), "kits_region_rollup"])
     print("Done.")
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+# src/lookup.py
+'''
+In-memory hash index for point lookups by N-number and Mode S code, used to
+enrich live ADS-B traffic. Rows are pre-serialized once per ingest so a batch
+lookup is just dict gets.
+
+Run `python lookup.py` to benchmark lookups/sec against the loaded data.
+'''
+import random
+import string
+import time
+from sqlalchemy.orm import Session
+from models import Kit, KitOut
+from versioned import Versioned
+
+HEX_DIGITS = set(string.hexdigits)
+OCT_DIGITS = set(string.octdigits)
+
+def normalize_n_number(value: str) -> str | None:
+    """'n123ab ' / 'N-123AB' -> '123AB' (the registry stores N-numbers without the N)."""
+    s = str(value).strip().upper().replace("-", "")
+    if s.startswith("N"):
+        s = s[1:]
+    return s or None
+
+def normalize_mode_s(value: str) -> int | None:
+    """
+    Mode S address as an int. ADS-B feeds send 6 hex digits ('A49B07'); the
+    registry's MODE S CODE column is 8 octal digits ('51115407').
+    Explicit 0x / 0o prefixes win; otherwise 8 octal digits are octal and
+    anything else that parses as hex is hex.
+    """
+    s = str(value).strip().upper()
+    if s.startswith("0X"):
+        s, base = s[2:], 16
+    elif s.startswith("0O"):
+        s, base = s[2:], 8
+    elif len(s) == 8 and set(s) <= OCT_DIGITS:
+        base = 8
+    else:
+        base = 16
+    if not s or not set(s) <= (HEX_DIGITS if base == 16 else OCT_DIGITS):
+        return None
+    code = int(s, base)
+    return code if code < 1 << 24 else None
+
+def _registry_mode_s(value: str | None) -> int | None:
+    # Registry values are octal; pandas may have read them as numbers ('51115407.0')
+    if not value:
+        return None
+    s = str(value).strip().removesuffix(".0")
+    return int(s, 8) if s and set(s) <= OCT_DIGITS else None
+
+class LookupIndex:
+    def __init__(self, rows: list[dict]):
+        self.by_n_number: dict[str, dict] = {}
+        self.by_mode_s: dict[int, dict] = {}
+        for row in rows:
+            n = normalize_n_number(row["n_number"]) if row.get("n_number") else None
+            if n:
+                self.by_n_number[n] = row
+            code = _registry_mode_s(row.get("mode_s_code"))
+            if code is not None:
+                self.by_mode_s[code] = row
+
+    @classmethod
+    def build(cls, db: Session) -> "LookupIndex":
+        rows = [KitOut.model_validate(k).model_dump(mode="json") for k in db.query(Kit).yield_per(5000)]
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.by_n_number)
+
+    def get_n_number(self, key: str) -> dict | None:
+        n = normalize_n_number(key)
+        return self.by_n_number.get(n) if n else None
+
+    def get_mode_s(self, key: str) -> dict | None:
+        code = normalize_mode_s(key)
+        return self.by_mode_s.get(code) if code is not None else None
+
+LOOKUP_INDEX = Versioned("lookup index", LookupIndex.build)
+
+def lookup_many(db: Session, n_numbers: list[str], mode_s_codes: list[str]) -> dict:
+    """Keys are echoed back as sent; misses map to None."""
+    index = LOOKUP_INDEX.get(db)
+    return {
+        "n_numbers": {k: index.get_n_number(k) for k in n_numbers},
+        "mode_s_codes": {k: index.get_mode_s(k) for k in mode_s_codes},
+    }
+
+def bench(index: LookupIndex, batch: int = 500, seconds: float = 3.0) -> dict:
+    """Lookups/sec for batches of mixed hits and misses, by key type."""
+    n_keys = ["N" + n for n in index.by_n_number] + ["N0MISS"]
+    hex_keys = [f"{c:06X}" for c in index.by_mode_s] + ["FFFFFF"]
+    out = {}
+    for name, keys, fn in [("n_number", n_keys, index.get_n_number), ("mode_s_hex", hex_keys, index.get_mode_s)]:
+        batches = [random.choices(keys, k=batch) for _ in range(50)]
+        done, t0 = 0, time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            for b in batches:
+                for k in b:
+                    fn(k)
+            done += batch * len(batches)
+        out[name] = round(done / (time.perf_counter() - t0))
+    return out
+
+if __name__ == "__main__":
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        index = LookupIndex.build(db)
+        print(f"Indexed {len(index):,} N-numbers / {len(index.by_mode_s):,} Mode S codes in {time.perf_counter() - t0:.2f}s")
+    finally:
+        db.close()
+    for name, rate in bench(index).items():
+        print(f"{name:>12}: {rate:,} lookups/sec")
@@ -2,18 +2,129 @@
 '''
 The main.py file is the entry point and controller for the FastAPI backend — it’s what turns the database and data-access logic into an API service that the Streamlit app can call. The st app never talks to the database directly; it always goes through this API.
 '''
-from fastapi import FastAPI, Depends, Query
+import asyncio
+import hmac
+import os
+import time
+from contextlib import asynccontextmanager, suppress
+from datetime import date
+from pathlib import Path
+from typing import Literal
+from fastapi import FastAPI, Depends, Query, Request, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from db import engine, SessionLocal
-from models import Base, Kit, KitOut
+from db import engine, SessionLocal, POOL_SIZE
+from models import Base, Kit, KitOut, LookupRequest
+import admission
 import crud
+import facets
+import lookup
+import metrics
+import slowlog
+import regions
+import singleflight
+import versioned
 # from schemas import KitOut
 
 
-Base.metadata.create_all(bind=engine)
+metrics.instrument_engine(engine)
+slowlog.install(engine)
+admission.install(SessionLocal)
 
-app = FastAPI(title="FAA Kits API")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# On shutdown, wait up to this long for in-flight requests before closing the pool
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+# Shared by every worker in the container, so one /admin/drain call (or `touch`) drains them all
+DRAIN_FILE = os.getenv("DRAIN_FILE", "/tmp/faa_api.drain")
+# pg_advisory_xact_lock key held while creating the schema, so workers don't race on CREATE TABLE
+SCHEMA_LOCK_KEY = 4_601_734
+
+# Lifecycle flags behind /ready
+state = {"ready": False, "draining": False}
+
+def warm_up():
+    """Blocking startup work: schema, a full warm pool, and the in-memory indexes."""
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        # On a fresh database every worker sees the tables missing; the losers would fail on
+        # duplicate relations. Waiting on the lock, they find the winner's tables instead.
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": SCHEMA_LOCK_KEY})
+        Base.metadata.create_all(bind=conn)
+
+    # Open POOL_SIZE connections at once so the first burst of requests doesn't pay for connects
+    conns = [engine.connect() for _ in range(POOL_SIZE)]
+    for conn in conns:
+        conn.exec_driver_sql("SELECT 1")
+    for conn in conns:
+        conn.close()
+
+    refresh_indexes()
+    if not ADMIN_TOKEN:
+        print("ADMIN_TOKEN is unset: /admin/* (including /admin/drain) is disabled")
+    print(f"Worker {os.getpid()} warm in {time.perf_counter() - t0:.2f}s")
+
+def refresh_indexes():
+    """Build (or rebuild, after an ingest) the in-memory indexes and rollups."""
+    db = SessionLocal()
+    try:
+        facets.get_index(db)
+        lookup.LOOKUP_INDEX.get(db)
+        regions.REGION_ROLLUPS.get(db)
+    finally:
+        db.close()
+
+async def refresh_loop():
+    # Pick up a new load in the background, so no request pays for the rebuild
+    while True:
+        await asyncio.sleep(versioned.RECHECK_SECONDS)
+        try:
+            await run_in_threadpool(refresh_indexes)
+        except Exception as e:
+            print(f"Index refresh failed: {e}")
+
+def launcher_started_at() -> float | None:
+    """Start time (epoch s) of the process that launched this worker: uvicorn's master in production."""
+    try:
+        with open(f"/proc/{os.getppid()}/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])   # field 22, starttime
+        with open("/proc/stat") as f:
+            boot = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+    return boot + ticks / os.sysconf("SC_CLK_TCK")
+
+def clear_stale_drain():
+    """
+    A fresh container start serves traffic even if the previous run was drained, but a
+    worker restarted mid-drain must not un-drain its siblings: only a drain file older
+    than the master process is from a previous run.
+    """
+    started = launcher_started_at()
+    with suppress(FileNotFoundError):
+        if started is None or os.path.getmtime(DRAIN_FILE) < started:
+            os.remove(DRAIN_FILE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(warm_up)
+    clear_stale_drain()
+    state["ready"] = True
+    refresher = asyncio.create_task(refresh_loop())
+    yield
+    refresher.cancel()
+    # uvicorn has stopped accepting connections; let in-flight requests finish first
+    state["ready"] = False
+    state["draining"] = True
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while metrics.HTTP_IN_FLIGHT.value() > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    engine.dispose()
+
+app = FastAPI(title="FAA Kits API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,6 +133,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Registered before record_request_metrics, so it runs inside it and shed requests are still counted
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    gate = admission.gate_for(request.url.path, request.query_params)
+    if gate is None:
+        return await call_next(request)
+    try:
+        async with gate.slot():
+            cls = admission.current_class.set(gate.name)
+            budget = admission.statement_budget_ms.set(gate.timeout_ms)
+            try:
+                return await call_next(request)
+            finally:
+                admission.current_class.reset(cls)
+                admission.statement_budget_ms.reset(budget)
+    except admission.Rejected as e:
+        metrics.ADMISSION_REJECTED.inc((e.cls, e.reason))
+        return JSONResponse(
+            {"detail": f"Server busy ({e}), retry shortly"},
+            status_code=503,
+            headers={"Retry-After": str(admission.RETRY_AFTER)},
+        )
+
+@app.exception_handler(OperationalError)
+async def database_error(request: Request, exc: OperationalError):
+    if admission.is_timeout(exc):
+        cls = admission.current_class.get() or "none"
+        metrics.STATEMENT_TIMEOUTS.inc((cls,))
+        return JSONResponse(
+            {"detail": f"Query exceeded the {cls} time budget"},
+            status_code=503,
+            headers={"Retry-After": str(admission.RETRY_AFTER)},
+        )
+    raise exc
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    metrics.HTTP_IN_FLIGHT.inc()
+    t0 = time.perf_counter()
+    status, size = 500, None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        size = int(response.headers["content-length"]) if "content-length" in response.headers else None
+        return response
+    finally:
+        metrics.HTTP_IN_FLIGHT.dec()
+        # Label by route template (/kits/filters/kitmdls), not the raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        metrics.observe_request(
+            route.path if route else "unmatched", request.method, status, time.perf_counter() - t0, size
+        )
+
 def get_db():
     db = SessionLocal()
     try:
@@ -29,65 +193,267 @@ def get_db():
     finally:
         db.close()
 
+def parse_csv(value: str | None) -> list[str] | None:
+    return [s.strip() for s in value.split(",") if s.strip()] if value else None
+
+def resolve_scope(states: str | None, region: str | None) -> list[str] | None:
+    """region=North,West and/or states=TX,OK -> canonical sorted state list (None = unscoped)."""
+    try:
+        scope = regions.canonical_states(parse_csv(region), parse_csv(states))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return list(scope) if scope is not None else None
+
+# Point-in-time counts; rollups and bitmaps only describe the current load
+HISTORY_COUNTS = {"kitmfg": crud.count_by_kitmfg, "state": crud.count_by_state, "engcat": crud.count_by_engcat}
+
+def scoped_counts(db: Session, facet: str, scope: list[str] | None, as_of: date | None = None):
+    """Region rollup when the scope was precomputed at ingest, else the facet bitmaps."""
+    def run():
+        if as_of is not None:
+            return HISTORY_COUNTS[facet](db, scope, as_of=as_of)
+        rows = regions.REGION_ROLLUPS.get(db).get(facet, tuple(scope) if scope is not None else None)
+        return rows if rows is not None else facets.count_by(db, facet, scope)
+    return singleflight.do(singleflight.key(f"agg/{facet}", states=scope, as_of=as_of), run)
+
+REGION_PARAM = Query(default=None, description="Comma-separated region names (North, South, East, West)")
+AS_OF_PARAM = Query(default=None, description="Answer from the registry as it was on this date (kits_history)")
+
 @app.get("/health")
 def health():
+    # Liveness: the process is up. Use /ready to decide whether to route traffic here.
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    draining = state["draining"] or os.path.exists(DRAIN_FILE)
+    if state["ready"] and not draining:
+        return {"status": "ready"}
+    return JSONResponse({"status": "draining" if draining else "starting"}, status_code=503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/kits", response_model=list[KitOut])
 def get_kits(
     mfr: str | None = Query(default=None),
     model: str | None = Query(default=None),
     state: str | None = Query(default=None),
     states: str | None = Query(default=None, description="Comma-separated states"),
+    region: str | None = REGION_PARAM,
+    kitmfg: str | None = Query(default=None),
+    kitmdl: str | None = Query(default=None),
+    engcat: str | None = Query(default=None),
+    acftcat: str | None = Query(default=None),
     limit: int = Query(default=100, ge=1, le=5000),
     offset: int = Query(default=0, ge=0),
+    as_of: date | None = AS_OF_PARAM,
     db: Session = Depends(get_db),
 ):
-    states_list = [s.strip() for s in states.split(",")] if states else None
-    total, rows = crud.list_kits(
-        db, mfr=mfr, model=model, state=state, states=states_list, limit=limit, offset=offset
+    states_list = resolve_scope(states, region)
+    if mfr or model or as_of:
+        # mfr/model are high-cardinality free text and the bitmaps only know today; leave those to Postgres
+        total, rows = crud.list_kits(
+            db, mfr=mfr, model=model, state=state, states=states_list,
+            kitmfg=kitmfg, kitmdl=kitmdl, engcat=engcat, acftcat=acftcat,
+            limit=limit, offset=offset, as_of=as_of,
+        )
+        return rows
+
+    filters = facets.normalize_filters(
+        kitmfg=[kitmfg] if kitmfg else None,
+        kitmdl=[kitmdl] if kitmdl else None,
+        engcat=[engcat] if engcat else None,
+        acftcat=[acftcat] if acftcat else None,
     )
+    # state and states are ANDed, matching crud.list_kits
+    if states_list is not None:
+        filters["state"] = states_list
+    if state:
+        scoped = filters.get("state")
+        filters["state"] = [state.upper()] if scoped is None or state.upper() in scoped else []
+    total, rows = facets.list_kits(db, filters=filters, limit=limit, offset=offset)
     return rows
 
+@app.get("/kits/facets")
+def get_facets(
+    states: str | None = Query(default=None, description="Comma-separated states"),
+    region: str | None = REGION_PARAM,
+    kitmfg: str | None = Query(default=None, description="Comma-separated kit manufacturers"),
+    kitmdl: str | None = Query(default=None, description="Comma-separated kit models"),
+    engcat: str | None = Query(default=None),
+    acftcat: str | None = Query(default=None),
+    db: Session = Depends(get_db),
+):
+    filters = facets.normalize_filters(
+        state=resolve_scope(states, region),
+        kitmfg=parse_csv(kitmfg),
+        kitmdl=parse_csv(kitmdl),
+        engcat=parse_csv(engcat),
+        acftcat=parse_csv(acftcat),
+    )
+    return facets.facet_counts(db, filters)
+
+@app.post("/kits/lookup")
+def lookup_kits(req: LookupRequest, db: Session = Depends(get_db)):
+    """Batch point lookups by N-number and/or Mode S code; misses come back as null."""
+    return lookup.lookup_many(db, req.n_numbers, req.mode_s_codes)
+
 # Filters ------------------------------------------------------------
 @app.get("/kits/filters/mfrs", response_model=list[str])
 def get_mfrs(db: Session = Depends(get_db)):
-    return crud.distinct_values(db, "mfr")
+    return singleflight.do(singleflight.key("filters/mfrs"), lambda: crud.distinct_values(db, "mfr"))
 
 @app.get("/kits/filters/kitmfgs", response_model=list[str])
 def get_kitmfgs(db: Session = Depends(get_db)):
-    return crud.distinct_values(db, "kitmfg")
+    return singleflight.do(singleflight.key("filters/kitmfgs"), lambda: crud.distinct_values(db, "kitmfg"))
 
 @app.get("/kits/filters/kitmdls", response_model=list[str])
 def get_kitmdls(kitmfg: str, db: Session = Depends(get_db)):
-    return crud.distinct_values(db, "kitmdl", kitmfg=kitmfg)#-------
+    return singleflight.do(
+        singleflight.key("filters/kitmdls", kitmfg=kitmfg),
+        lambda: crud.distinct_values(db, "kitmdl", kitmfg=kitmfg),
+    )
 
 @app.get("/kits/filters/states", response_model=list[str])
 def get_states(db: Session = Depends(get_db)):
-    return crud.distinct_values(db, "state")
+    return singleflight.do(singleflight.key("filters/states"), lambda: crud.distinct_values(db, "state"))
+
+@app.get("/kits/filters/regions")
+def get_regions():
+    return regions.REGION_TO_STATES
 
 # Aggregations -----------------------------------------------------
+def agg_response(key: str, rows: list[tuple], top: int | None, include_other: bool):
+    """
+    Plain [{key, count}, ...] by default (what the app has always consumed).
+    With top/include_other: {"items": first N rows [+ an "Other" row], "total": grand total,
+    "groups": number of groups before truncation}.
+    """
+    if top is None and not include_other:
+        return [{key: k, "count": c} for k, c in rows]
+    total = sum(c for _, c in rows)
+    head = rows[:top] if top is not None else rows
+    items = [{key: k, "count": c} for k, c in head]
+    rest = total - sum(c for _, c in head)
+    if include_other and rest:
+        items.append({key: "Other", "count": rest, "is_other": True})
+    return {"items": items, "total": total, "groups": len(rows)}
+
 @app.get("/kits/agg/by_kitmfg")
-def agg_by_kitmfg(states: str | None = Query(default=None), db: Session = Depends(get_db)):
-    states_list = [s.strip() for s in states.split(",")] if states else None
-    rows = crud.count_by_kitmfg(db, states_list)
-    return [{"kitmfg": k, "count": c} for k, c in rows]
+def agg_by_kitmfg(
+    states: str | None = Query(default=None),
+    region: str | None = REGION_PARAM,
+    top: int | None = Query(default=None, ge=1, description="Return only the N largest groups"),
+    include_other: bool = Query(default=False, description="Sum the remaining groups into an Other row"),
+    as_of: date | None = AS_OF_PARAM,
+    db: Session = Depends(get_db),
+):
+    rows = scoped_counts(db, "kitmfg", resolve_scope(states, region), as_of)
+    return agg_response("kitmfg", rows, top, include_other)
 
 @app.get("/kits/agg/by_state")
-def agg_by_state(states: str | None = Query(default=None), db: Session = Depends(get_db)):
-    states_list = [s.strip() for s in states.split(",")] if states else None
-    rows = crud.count_by_state(db, states_list)
-    return [{"state": s, "count": c} for s, c in rows]
+def agg_by_state(
+    states: str | None = Query(default=None),
+    region: str | None = REGION_PARAM,
+    top: int | None = Query(default=None, ge=1),
+    include_other: bool = Query(default=False),
+    as_of: date | None = AS_OF_PARAM,
+    db: Session = Depends(get_db),
+):
+    rows = scoped_counts(db, "state", resolve_scope(states, region), as_of)
+    return agg_response("state", rows, top, include_other)
 
 @app.get("/kits/agg/by_engcat")
-def agg_by_engcat(states: str | None = Query(None), db: Session = Depends(get_db)):
-    states_list = [s.strip() for s in states.split(",")] if states else None
-    return [{"engcat": e, "count": c} for e, c in crud.count_by_engcat(db, states_list)]
+def agg_by_engcat(
+    states: str | None = Query(None),
+    region: str | None = REGION_PARAM,
+    top: int | None = Query(default=None, ge=1),
+    include_other: bool = Query(default=False),
+    as_of: date | None = AS_OF_PARAM,
+    db: Session = Depends(get_db),
+):
+    rows = [(e, c) for e, c in scoped_counts(db, "engcat", resolve_scope(states, region), as_of) if e]
+    return agg_response("engcat", rows, top, include_other)
+
+@app.get("/kits/agg/timeseries")
+def agg_timeseries(
+    field: Literal["cert_issue_date", "air_worth_date", "year_mfr"] = Query(default="cert_issue_date"),
+    grain: Literal["month", "year"] = Query(default="month"),
+    by: Literal["kitmfg", "state", "engcat"] | None = Query(default=None),
+    states: str | None = Query(default=None),
+    region: str | None = REGION_PARAM,
+    kitmfg: str | None = Query(default=None),
+    engcat: str | None = Query(default=None),
+    start: date | None = Query(default=None),
+    end: date | None = Query(default=None),
+    db: Session = Depends(get_db),
+):
+    params = dict(field=field, grain=grain, by=by, states=resolve_scope(states, region),
+                  kitmfg=kitmfg, engcat=engcat, start=start, end=end)
+    rows = singleflight.do(singleflight.key("agg/timeseries", **params), lambda: crud.timeseries(db, **params))
+    if by:
+        return [{"period": p, by: v, "count": c} for p, v, c in rows]
+    return [{"period": p, "count": c} for p, c in rows]
 
 # Metrics -----------------------------------------------------
 @app.get("/kits/metrics/city_count")
-def city_count(states: str | None = Query(default=None), db: Session = Depends(get_db)):
-    states_list = [s.strip() for s in states.split(",")] if states else None
-    count = crud.count_distinct_cities(db, states_list)
-    return {"city_count": count}
+def city_count(
+    states: str | None = Query(default=None),
+    region: str | None = REGION_PARAM,
+    as_of: date | None = AS_OF_PARAM,
+    db: Session = Depends(get_db),
+):
+    scope = resolve_scope(states, region)
+
+    def run():
+        if as_of is not None:
+            return crud.count_distinct_cities(db, scope, as_of=as_of)
+        rolled = regions.REGION_ROLLUPS.get(db).get("city_count", tuple(scope) if scope is not None else None)
+        return rolled[0][1] if rolled else crud.count_distinct_cities(db, scope)
+    return {"city_count": singleflight.do(singleflight.key("metrics/city_count", states=scope, as_of=as_of), run)}
+
+@app.get("/kits/metrics/history")
+def history_stats(db: Session = Depends(get_db)):
+    """Snapshots kept in kits_history (usable as as_of dates) and its storage growth per snapshot."""
+    return [
+        {
+            "snapshot_date": s.snapshot_date, "rows": s.rows, "added": s.added, "closed": s.closed,
+            "history_rows": s.history_rows, "history_mb": round(s.history_bytes / 2**20, 2),
+        }
+        for s in crud.snapshots(db)
+    ]
+
+@app.get("/kits/metrics/facet_index")
+def facet_index_stats(db: Session = Depends(get_db)):
+    index = facets.get_index(db)
+    return {"rows": len(index), "loaded_at": facets.FACET_INDEX.version, "facets": index.memory_usage()}
+
+# Admin -----------------------------------------------------
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    # Fail closed: without ADMIN_TOKEN the admin routes don't exist
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/admin/slow_queries", dependencies=[Depends(require_admin)])
+def slow_queries(limit: int = Query(default=50, ge=1, le=1000)):
+    return {
+        "enabled": slowlog.SLOW_QUERY_MS > 0,
+        "threshold_ms": slowlog.SLOW_QUERY_MS,
+        "entries": slowlog.entries(limit),
+    }
+
+@app.post("/admin/drain", dependencies=[Depends(require_admin)])
+def drain():
+    """Fail /ready on every worker so the load balancer stops sending traffic before a restart."""
+    state["draining"] = True
+    Path(DRAIN_FILE).touch()   # mtime marks this drain as newer than the master (see clear_stale_drain)
+    return {"status": "draining", "in_flight": metrics.HTTP_IN_FLIGHT.value()}
 
+@app.delete("/admin/slow_queries", dependencies=[Depends(require_admin)])
+def clear_slow_queries():
+    slowlog.clear()
+    return {"status": "cleared"}
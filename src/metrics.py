@@ -0,0 +1,182 @@
+# src/metrics.py
+'''
+Minimal Prometheus instrumentation for the API: request latency/size
+histograms, in-flight requests, per-query SQL timing and connection-pool
+checkout waits. Rendered in the Prometheus text format on /metrics.
+
+Values are per process; with several workers, scrape each one (or sum).
+'''
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: tuple[str, ...], values: tuple, le: str | None = None) -> str:
+    pairs = list(zip(names, values))
+    if le is not None:
+        pairs.append(("le", le))
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in sorted(self._values.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def set(self, value: float, labels: tuple = ()):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, labels: tuple = ()):
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def _samples(self):
+        out = []
+        for k, s in sorted(self._series.items()):
+            for b, c in zip(self.buckets, s):
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, str(b))} {c}")
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, '+Inf')} {s[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {s[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {s[-1]}")
+        return out
+
+REGISTRY: list[_Metric] = []
+_POOLS: list = []   # instrumented engine pools, sampled at scrape time
+
+# ---------- HTTP ----------
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency.", ("route", "method"))
+HTTP_RESPONSE_SIZE = Histogram("http_response_size_bytes", "HTTP response body size.", ("route",), buckets=SIZE_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+
+# ---------- SQL ----------
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement execution time by statement type.", ("statement",))
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "SQL statements that raised.", ("statement",))
+DB_POOL_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.")
+DB_POOL = Gauge("db_pool_connections", "Connection pool state at scrape time.", ("state",))
+
+# ---------- Coalescing (singleflight.py) ----------
+SINGLEFLIGHT = Counter(
+    "singleflight_requests_total",
+    "Coalescable reads by key; role=shared were answered by another request's in-flight query (queries saved).",
+    ("key", "role"),
+)
+
+# ---------- Admission control (admission.py) ----------
+ADMISSION_ACTIVE = Gauge("admission_active_requests", "Admitted requests running, by class.", ("class",))
+ADMISSION_QUEUED = Gauge("admission_queued_requests", "Requests waiting for an admission slot, by class.", ("class",))
+ADMISSION_WAIT = Histogram("admission_wait_seconds", "Time spent waiting for an admission slot.", ("class",))
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests shed with 503 (reason=full|wait_timeout).", ("class", "reason")
+)
+STATEMENT_TIMEOUTS = Counter(
+    "statement_timeouts_total", "Requests whose SQL hit the class statement_timeout.", ("class",)
+)
+
+def _verb(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+
+def observe_request(route: str, method: str, status: int, seconds: float, size: int | None):
+    HTTP_REQUESTS.inc((route, method, status))
+    HTTP_LATENCY.observe(seconds, (route, method))
+    if size is not None:
+        HTTP_RESPONSE_SIZE.observe(size, (route,))
+
+def instrument_engine(engine: Engine):
+    """Attach query timing and pool-wait tracking to an engine (idempotent)."""
+    if getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        t0 = conn.info["query_start"].pop()
+        DB_QUERY_LATENCY.observe(time.perf_counter() - t0, (_verb(statement),))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        starts = ctx.connection.info.get("query_start") if ctx.connection is not None else None
+        if starts:
+            starts.pop()
+        DB_QUERY_ERRORS.inc((_verb(ctx.statement or ""),))
+
+    # The pool has no "checkout requested" event, so time the blocking get itself
+    pool = engine.pool
+    do_get = pool._do_get
+
+    def timed_do_get():
+        t0 = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - t0)
+
+    pool._do_get = timed_do_get
+    _POOLS.append(pool)
+
+def render() -> str:
+    for pool in _POOLS:
+        for state in ("size", "checkedout", "overflow", "checkedin"):
+            fn = getattr(pool, state, None)
+            if fn is not None:
+                DB_POOL.set(fn(), (state,))
+    lines = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,8 @@
 # src/models.py
 
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, Date
-from pydantic import BaseModel
+from sqlalchemy import BigInteger, Column, Integer, SmallInteger, String, Date, DateTime, Table
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import date
 
@@ -28,6 +28,7 @@ class Kit(Base):
     no_eng         = Column(Integer)
     city           = Column(String)
     state          = Column(String, index=True)
+    state_id       = Column(SmallInteger)   # key into dim_state; the partition key when kits is partitioned
     zip_min        = Column(String)
     kitmfg         = Column(String, index=True)
     kitmdl         = Column(String)
@@ -39,6 +40,104 @@ class Kit(Base):
     cert_issue_date  = Column(Date)
     air_worth_date   = Column(Date)
 
+class StateDim(Base):
+    # dim_state: kits.state_id -> state code. Ingest only appends, so ids are stable across loads
+    __tablename__ = "dim_state"
+
+    id    = Column(SmallInteger, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+class KitsMeta(Base):
+    # One row, stamped by ingest; in-memory indexes compare against it to know when to rebuild
+    __tablename__ = "kits_meta"
+
+    loaded_at = Column(DateTime(timezone=True), primary_key=True)
+
+class KitTimeseries(Base):
+    # Monthly registration counts by kitmfg/state/engcat, rebuilt by ingest (see ingest_kits.create_rollups).
+    # year_mfr rows use Jan 1 of the build year as their period.
+    __tablename__ = "kits_ts_monthly"
+
+    date_field = Column(String, primary_key=True)   # cert_issue_date | air_worth_date | year_mfr
+    period     = Column(Date, primary_key=True)
+    kitmfg     = Column(String, primary_key=True)
+    state      = Column(String, primary_key=True)
+    engcat     = Column(String, primary_key=True)
+    cnt        = Column(Integer)
+
+def _ts_rollup(name: str, *dims: str) -> Table:
+    # kits_ts_monthly summed down to fewer columns (see ingest_kits.create_rollups)
+    return Table(
+        name, Base.metadata,
+        Column("date_field", String), Column("period", Date),
+        *(Column(d, String) for d in dims),
+        Column("cnt", Integer),
+    )
+
+# Timeseries rollups, smallest first; crud reads the first one holding every column a
+# query groups or filters on. The full cube is close to one row per registration.
+TS_ROLLUPS = {
+    (): _ts_rollup("kits_ts_total"),
+    ("kitmfg",): _ts_rollup("kits_ts_kitmfg", "kitmfg"),
+    ("state",): _ts_rollup("kits_ts_state", "state"),
+    ("engcat",): _ts_rollup("kits_ts_engcat", "engcat"),
+    ("kitmfg", "state", "engcat"): KitTimeseries.__table__,
+}
+
+class KitRegionRollup(Base):
+    # Per-facet counts for "All" and every combination of named regions, rebuilt by ingest
+    # (see ingest_kits.create_region_rollups). facet="city_count" rows carry value=NULL.
+    __tablename__ = "kits_region_rollup"
+
+    region_key = Column(String, primary_key=True)   # "All", "East", "East,North", ...
+    facet      = Column(String, primary_key=True)
+    value      = Column(String, primary_key=True)
+    cnt        = Column(Integer)
+
+class KitHistory(Base):
+    # One row per version of a registration; ingest closes changed/removed rows and opens new
+    # ones (see ingest_kits.snapshot_history). valid_to NULL = still current. Stored as text
+    # rather than dim ids because dim ids are renumbered on every load.
+    __tablename__ = "kits_history"
+
+    n_number       = Column(String, primary_key=True)
+    valid_from     = Column(Date, primary_key=True)
+    valid_to       = Column(Date)
+    row_hash       = Column(String, nullable=False)
+
+    serial_number  = Column(String)
+    mfr_mdl_code   = Column(String)
+    mfr            = Column(String)
+    model          = Column(String)
+    acftcat        = Column(String)
+    no_seats       = Column(Integer)
+    ac_weight      = Column(String)
+    engcat         = Column(String)
+    surfcat        = Column(String)
+    no_eng         = Column(Integer)
+    city           = Column(String)
+    state          = Column(String)
+    zip_min        = Column(String)
+    kitmfg         = Column(String)
+    kitmdl         = Column(String)
+    mode_s_code    = Column(String)
+    year_mfr         = Column(Integer)
+    last_action_date = Column(Date)
+    cert_issue_date  = Column(Date)
+    air_worth_date   = Column(Date)
+
+class KitSnapshot(Base):
+    # One row per ingested snapshot: what the delta added/closed and what kits_history costs
+    __tablename__ = "kits_snapshots"
+
+    snapshot_date = Column(Date, primary_key=True)
+    rows          = Column(Integer)        # registrations current as of this snapshot
+    added         = Column(Integer)        # versions opened (new or changed registrations)
+    closed        = Column(Integer)        # versions closed (changed or deregistered)
+    history_rows  = Column(BigInteger)
+    history_bytes = Column(BigInteger)     # pg_total_relation_size(kits_history) after the delta
+    loaded_at     = Column(DateTime(timezone=True))
+
 # ---------- Pydantic schema (API responses) ----------
 class KitOut(BaseModel):
     n_number: str
@@ -58,6 +157,14 @@ class KitOut(BaseModel):
     kitmfg: Optional[str] = None
     kitmdl: Optional[str] = None
     mode_s_code: Optional[str] = None
+    year_mfr: Optional[int] = None
+    last_action_date: Optional[date] = None
+    cert_issue_date: Optional[date] = None
+    air_worth_date: Optional[date] = None
 
     class Config:
-        from_attributes = True  # map from SQLAlchemy rows -> Pydantic model
\ No newline at end of file
+        from_attributes = True  # map from SQLAlchemy rows -> Pydantic model
+
+class LookupRequest(BaseModel):
+    n_numbers: list[str] = Field(default_factory=list, max_length=1000)
+    mode_s_codes: list[str] = Field(default_factory=list, max_length=1000, description="6-digit hex or 8-digit octal")
@@ -2,6 +2,7 @@
 import os
 import pandas as pd
 from pathlib import Path
+import profiling
 
 SRC = os.environ.get("DATA_XLSX", "/app/data/demo.xlsx")
 OUT = os.environ.get("DATA_OUT", "/app/data/processed/kits_prepared.parquet")
@@ -38,33 +39,51 @@ RENAME = {
     "AIR WORTH DATE": "air_worth_date",
 }
 
-def main():
-    if not os.path.exists(SRC):
-        raise FileNotFoundError(SRC)
+def read_source(path: str) -> pd.DataFrame:
+    # The FAA download is Excel; large (synthetic/benchmark) registries come as parquet or csv
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+    return pd.read_excel(path, engine="openpyxl")
 
-    df = pd.read_excel(SRC, engine="openpyxl")
-    df = df[NEEDED].rename(columns=RENAME)
+def main(src: str = SRC, out: str = OUT):
+    if not os.path.exists(src):
+        raise FileNotFoundError(src)
 
-    # trim strings
-    for c in ["n_number","mfr","model","acftcat","ac_weight","engcat","surfcat",
-              "city","state","kitmfg","kitmdl","zip_min","mode_s_code"]:
-        df[c] = df[c].astype(str).str.strip()
+    with profiling.run("prepare", src=src, out=out):
+        with profiling.stage("read_source") as st:
+            df = read_source(src)
+            st["rows"] = len(df)
 
-    # state normalization
-    df["state"] = df["state"].str.upper().str[:2]
+        with profiling.stage("clean_strings") as st:
+            df = df[NEEDED].rename(columns=RENAME)
 
-    # numeric coercions
-    df["no_seats"] = pd.to_numeric(df["no_seats"], errors="coerce").astype("Int64")
-    df["no_eng"]   = pd.to_numeric(df["no_eng"],   errors="coerce").astype("Int64")
-    df["year_mfr"] = pd.to_numeric(df["year_mfr"], errors="coerce").astype("Int64")
+            # trim strings
+            for c in ["n_number","mfr","model","acftcat","ac_weight","engcat","surfcat",
+                      "city","state","kitmfg","kitmdl","zip_min","mode_s_code"]:
+                df[c] = df[c].astype(str).str.strip()
 
-    # date coercions (result is datetime64[ns]; convert to date for parquet portability)
-    for dcol in ["last_action_date","cert_issue_date","air_worth_date"]:
-        df[dcol] = pd.to_datetime(df[dcol], errors="coerce").dt.date
+            # state normalization
+            df["state"] = df["state"].str.upper().str[:2]
+            st["rows"] = len(df)
 
-    Path(os.path.dirname(OUT)).mkdir(parents=True, exist_ok=True)
-    df.to_parquet(OUT, index=False)
-    print(f"Prepared {len(df)} rows → {OUT}")
+        with profiling.stage("coerce_types") as st:
+            # numeric coercions
+            df["no_seats"] = pd.to_numeric(df["no_seats"], errors="coerce").astype("Int64")
+            df["no_eng"]   = pd.to_numeric(df["no_eng"],   errors="coerce").astype("Int64")
+            df["year_mfr"] = pd.to_numeric(df["year_mfr"], errors="coerce").astype("Int64")
+
+            # date coercions (result is datetime64[ns]; convert to date for parquet portability)
+            for dcol in ["last_action_date","cert_issue_date","air_worth_date"]:
+                df[dcol] = pd.to_datetime(df[dcol], errors="coerce").dt.date
+            st["rows"] = len(df)
+
+        with profiling.stage("write_parquet") as st:
+            Path(os.path.dirname(out)).mkdir(parents=True, exist_ok=True)
+            df.to_parquet(out, index=False)
+            st["rows"] = len(df)
+    print(f"Prepared {len(df)} rows → {out}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,123 @@
+# src/profiling.py
+'''
+Per-stage instrumentation for the prepare/ingest scripts: wall time, rows/sec,
+process RSS and, with RUN_TRACEMALLOC=1, peak Python memory, written as a JSON
+run report named <run>_<UTC stamp>.json. Set PROFILE_DIR to also dump a
+cProfile file per stage into PROFILE_DIR/<run>_<UTC stamp>/ (open with snakeviz
+or `python -m pstats`), so every run keeps its own profiles next to its report.
+
+    with profiling.run("prepare") as report:
+        with profiling.stage("read_excel") as st:
+            df = ...
+            st["rows"] = len(df)
+'''
+import cProfile
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPORT_DIR = os.getenv("RUN_REPORT_DIR", "/app/data/processed/reports")
+PROFILE_DIR = os.getenv("PROFILE_DIR")                        # unset = no cProfile dumps
+TRACEMALLOC = os.getenv("RUN_TRACEMALLOC", "0") == "1"       # off: tracing inflates pandas-heavy stage times
+
+_current: dict | None = None
+
+def _rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except OSError:
+        return None
+
+def _stamp() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(r / (2**20 if os.uname().sysname == "Darwin" else 2**10), 1)
+
+@contextmanager
+def run(name: str, **meta):
+    """Collect the stages below into one report, written to REPORT_DIR on exit."""
+    global _current
+    report = {
+        "run": name,
+        # Names the report file and the profile directory; nested runs share their parent's
+        "id": _current["id"] if _current else f"{name}_{_stamp()}",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        # Stage times are only comparable between runs with the same setting
+        "tracemalloc": TRACEMALLOC,
+        "meta": meta,
+        "stages": [],
+    }
+    outer, _current = _current, report
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield report
+        ok = True
+    finally:
+        _current = outer
+        report["ok"] = ok
+        report["wall_s"] = round(time.perf_counter() - t0, 3)
+        report["max_rss_mb"] = _max_rss_mb()
+        if outer is not None:
+            outer["stages"].append({"name": name, "wall_s": report["wall_s"], "stages": report["stages"]})
+        else:
+            write(report)
+
+@contextmanager
+def stage(name: str):
+    """Time one stage. Set `info["rows"]` inside the block to get rows/sec."""
+    info: dict = {"name": name}
+    started_tracing = TRACEMALLOC and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if TRACEMALLOC:
+        tracemalloc.reset_peak()
+    prof = cProfile.Profile() if PROFILE_DIR else None
+    if prof:
+        prof.enable()
+    t0 = time.perf_counter()
+    try:
+        yield info
+    finally:
+        wall = time.perf_counter() - t0
+        if prof:
+            prof.disable()
+        info["wall_s"] = round(wall, 3)
+        if info.get("rows") and wall > 0:
+            info["rows_per_s"] = round(info["rows"] / wall)
+        if TRACEMALLOC:
+            info["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            if started_tracing:
+                tracemalloc.stop()
+        info["rss_mb"] = _rss_mb()
+        info["max_rss_mb"] = _max_rss_mb()
+        if prof:
+            run_dir = os.path.join(PROFILE_DIR, _current["id"] if _current else f"adhoc_{_stamp()}")
+            Path(run_dir).mkdir(parents=True, exist_ok=True)
+            info["profile"] = os.path.join(run_dir, f"{name}.prof")
+            prof.dump_stats(info["profile"])
+        if _current is not None:
+            _current["stages"].append(info)
+        rate = f", {info['rows_per_s']:,} rows/s" if "rows_per_s" in info else ""
+        print(f"[{name}] {wall:.2f}s{rate}, py peak {info.get('py_peak_mb', '-')} MB, rss {info['rss_mb']} MB")
+
+def write(report: dict) -> str | None:
+    try:
+        Path(REPORT_DIR).mkdir(parents=True, exist_ok=True)
+        path = os.path.join(REPORT_DIR, f"{report['id']}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    except OSError as e:
+        print(f"Could not write run report: {e}")
+        return None
+    print(f"Run report → {path}")
+    return path
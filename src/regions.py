@@ -0,0 +1,103 @@
+# src/regions.py
+'''
+Region scopes owned by the API. Clients send `region=North,West` instead of
+shipping the state list; every scope (named regions or an explicit `states`
+list) is canonicalized to a sorted, de-duplicated, upper-cased state tuple.
+
+Ingest precomputes per-facet counts for "All" and every combination of the
+named regions into `kits_region_rollup`, so a region-scoped dashboard reads a
+few hundred cached rows instead of re-filtering `kits`.
+'''
+from itertools import combinations
+from sqlalchemy.orm import Session
+from models import KitRegionRollup
+from versioned import Versioned
+
+REGION_TO_STATES = {
+    "North": ["CT","ME","MA","NH","NJ","NY","PA","RI","VT","MI","MN","WI","IA","ND","SD","NE","OH","IL","IN"],
+    "South": ["AL","AR","FL","GA","KY","LA","MS","NC","OK","SC","TN","TX","VA","WV","MD","DE","DC"],
+    "East":  ["CT","DE","DC","FL","GA","MA","MD","ME","NC","NH","NJ","NY","PA","RI","SC","VA","VT"],
+    "West":  ["AK","AZ","CA","CO","HI","ID","MT","NM","NV","OR","UT","WA","WY"],
+}
+ALL = "All"
+
+# Facets stored in the rollup; city_count is a single (value=NULL) row per scope
+ROLLUP_FACETS = ("state", "kitmfg", "engcat")
+
+def parse_regions(names: list[str] | None) -> list[str] | None:
+    """Case-insensitive region names -> canonical names. None/"All" means unscoped."""
+    if not names:
+        return None
+    lookup = {r.lower(): r for r in REGION_TO_STATES}
+    out = set()
+    for n in names:
+        if n.lower() == ALL.lower():
+            return None
+        if n.lower() not in lookup:
+            raise ValueError(f"Unknown region: {n} (expected one of {', '.join([ALL, *REGION_TO_STATES])})")
+        out.add(lookup[n.lower()])
+    return sorted(out)
+
+def canonical_states(regions: list[str] | None = None, states: list[str] | None = None) -> tuple[str, ...] | None:
+    """
+    Sorted state tuple for a scope, or None when unscoped.
+    regions and states together are ANDed (states refine the region).
+    """
+    scope = None
+    names = parse_regions(regions)
+    if names:
+        scope = {s for r in names for s in REGION_TO_STATES[r]}
+    if states:
+        picked = {s.strip().upper() for s in states if s.strip()}
+        scope = picked if scope is None else scope & picked
+    return tuple(sorted(scope)) if scope is not None else None
+
+def rollup_scopes() -> dict[str, tuple[str, ...] | None]:
+    """Every scope ingest precomputes: All plus each non-empty combination of named regions."""
+    scopes: dict[str, tuple[str, ...] | None] = {ALL: None}
+    names = sorted(REGION_TO_STATES)
+    for k in range(1, len(names) + 1):
+        for combo in combinations(names, k):
+            scopes[",".join(combo)] = canonical_states(list(combo))
+    return scopes
+
+def partition_groups() -> dict[str, list[str]]:
+    """
+    Disjoint state groups for list-partitioning kits: states that belong to exactly
+    the same set of regions share a group (named after those regions), so any
+    region scope maps to whole partitions. States outside every region are left
+    to the default partition.
+    """
+    member: dict[str, list[str]] = {}
+    for r in sorted(REGION_TO_STATES):
+        for s in REGION_TO_STATES[r]:
+            member.setdefault(s, []).append(r)
+    groups: dict[str, list[str]] = {}
+    for s, rs in sorted(member.items()):
+        groups.setdefault("_".join(rs).lower(), []).append(s)
+    return groups
+
+class RegionRollups:
+    def __init__(self, rows: list[tuple[str, str, str | None, int]]):
+        # Any scope whose canonical state set matches a precomputed one can use it,
+        # including a plain `states=` list that happens to equal a region.
+        self.key_for_scope = {states: key for key, states in rollup_scopes().items()}
+        self.counts: dict[tuple[str, str], list[tuple[str | None, int]]] = {}
+        for key, facet, value, cnt in rows:
+            self.counts.setdefault((key, facet), []).append((value, cnt))
+        for v in self.counts.values():
+            v.sort(key=lambda vc: vc[1], reverse=True)
+
+    @classmethod
+    def build(cls, db: Session) -> "RegionRollups":
+        R = KitRegionRollup
+        return cls(db.query(R.region_key, R.facet, R.value, R.cnt).all())
+
+    def get(self, facet: str, scope: tuple[str, ...] | None) -> list[tuple[str | None, int]] | None:
+        """Precomputed (value, count) pairs, or None if this scope/facet wasn't rolled up."""
+        key = self.key_for_scope.get(scope)
+        if key is None:
+            return None
+        return self.counts.get((key, facet))
+
+REGION_ROLLUPS = Versioned("region rollups", RegionRollups.build)
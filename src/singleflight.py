@@ -0,0 +1,62 @@
+# src/singleflight.py
+'''
+Request coalescing for identical concurrent reads. The first caller for a key
+(route + normalized params) runs the query; callers arriving while it is in
+flight wait for it and share its result (or its exception) instead of sending
+the same statement to Postgres again. Nothing is cached once the call returns.
+
+    rows = singleflight.do(singleflight.key("by_kitmfg", states=scope), lambda: crud.count_by_kitmfg(db, scope))
+
+Results are shared between requests, so callers must not mutate them.
+'''
+import os
+import threading
+from typing import Callable, TypeVar
+import metrics
+
+T = TypeVar("T")
+
+ENABLED = os.getenv("SINGLEFLIGHT", "1") == "1"
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+_lock = threading.Lock()
+_calls: dict[tuple, _Call] = {}
+
+def key(name: str, **params) -> tuple:
+    """Hashable key; lists become tuples and None/empty params are dropped."""
+    norm = tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in params.items() if v is not None
+    ))
+    return (name, norm)
+
+def do(k: tuple, fn: Callable[[], T]) -> T:
+    if not ENABLED:
+        return fn()
+    with _lock:
+        call = _calls.get(k)
+        leader = call is None
+        if leader:
+            call = _calls[k] = _Call()
+    if not leader:
+        call.done.wait()
+        metrics.SINGLEFLIGHT.inc((k[0], "shared"))
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    metrics.SINGLEFLIGHT.inc((k[0], "leader"))
+    try:
+        call.result = fn()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            del _calls[k]
+        call.done.set()
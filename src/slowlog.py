@@ -0,0 +1,109 @@
+# src/slowlog.py
+'''
+Opt-in slow-query recorder. When SLOW_QUERY_MS is set, any statement on the
+API engine slower than that is kept (SQL, bound parameters, duration) in a
+bounded ring buffer, and SELECTs are re-run under EXPLAIN (ANALYZE, BUFFERS)
+on a background thread so the plan can be inspected on /admin/slow_queries.
+'''
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))        # 0 / unset = disabled
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+# Don't re-EXPLAIN the same statement shape more often than this (seconds)
+EXPLAIN_COOLDOWN = float(os.getenv("SLOW_QUERY_EXPLAIN_COOLDOWN", "60"))
+
+_entries: deque = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_jobs: queue.Queue = queue.Queue(maxsize=50)
+_last_explained: dict[str, float] = {}
+
+def _jsonable(params):
+    if isinstance(params, dict):
+        return {k: _jsonable(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_jsonable(v) for v in params]
+    if params is None or isinstance(params, (str, int, float, bool)):
+        return params
+    return str(params)
+
+def _explain_worker(engine: Engine):
+    while True:
+        entry, statement, parameters = _jobs.get()
+        raw = None
+        try:
+            # Raw DBAPI connection: bypasses engine events, so this can't re-trigger the recorder
+            raw = engine.raw_connection()
+            cur = raw.cursor()
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            entry["plan"] = "\n".join(r[0] for r in cur.fetchall())
+            raw.rollback()
+        except Exception as e:
+            entry["plan_error"] = f"{type(e).__name__}: {e}"
+        finally:
+            if raw is not None:
+                raw.close()
+
+def _maybe_explain(entry: dict, statement: str, parameters):
+    if not SLOW_QUERY_EXPLAIN or not statement.lstrip().upper().startswith("SELECT"):
+        return
+    now = time.monotonic()
+    if now - _last_explained.get(statement, -EXPLAIN_COOLDOWN) < EXPLAIN_COOLDOWN:
+        return
+    _last_explained[statement] = now
+    entry["plan"] = "pending"
+    try:
+        _jobs.put_nowait((entry, statement, parameters))
+    except queue.Full:
+        entry["plan"] = None
+
+def install(engine: Engine, threshold_ms: float = SLOW_QUERY_MS) -> bool:
+    """Attach the recorder to an engine. No-op (returns False) when disabled."""
+    if threshold_ms <= 0:
+        return False
+    threshold = threshold_ms / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slowlog_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["slowlog_start"].pop()
+        if elapsed < threshold:
+            return
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(elapsed * 1000, 2),
+            "statement": statement,
+            "parameters": _jsonable(parameters),
+            "plan": None,
+        }
+        _entries.append(entry)
+        if not executemany:
+            _maybe_explain(entry, statement, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        starts = ctx.connection.info.get("slowlog_start") if ctx.connection is not None else None
+        if starts:
+            starts.pop()
+
+    threading.Thread(target=_explain_worker, args=(engine,), name="slowlog-explain", daemon=True).start()
+    print(f"Slow-query log enabled (>{threshold_ms:g} ms, keeping {SLOW_QUERY_LOG_SIZE})")
+    return True
+
+def entries(limit: int | None = None) -> list[dict]:
+    """Most recent first."""
+    out = list(reversed(_entries))
+    return out[:limit] if limit else out
+
+def clear():
+    _entries.clear()
+    _last_explained.clear()
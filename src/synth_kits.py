@@ -0,0 +1,102 @@
+# src/synth_kits.py
+'''
+Synthetic FAA kit registry generator for benchmarks.
+
+Rows are bootstrapped from a real registry sample (DATA_XLSX, demo.xlsx by
+default): aircraft-type columns (kitmfg/kitmdl/mfr/model/engcat/...) are drawn
+together from one seed row and location columns (city/state/zip) from another,
+so the real kitmfg and state skew carries over. A small Zipf-distributed tail of
+extra manufacturers keeps kitmfg cardinality growing with size like the real
+file does. N-numbers and Mode S codes are unique.
+
+Output has the raw `prepare_kits.NEEDED` columns, so it feeds prepare_kits as-is.
+
+    python synth_kits.py --scale 10 --out /app/data/synth/kits_x10.parquet
+'''
+import argparse
+import os
+import string
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from prepare_kits import NEEDED, read_source
+
+# Roughly the number of kit-built (KITMFG present) aircraft in the releasable FAA registry
+REAL_ROWS = 38_000
+
+TYPE_COLS = ["MFR MDL CODE", "MFR", "MODEL", "ACFTCAT", "NO-SEATS", "AC-WEIGHT", "ENGCAT",
+             "SURFCAT", "NO-ENG", "KITMFG", "KITMDL"]
+LOCATION_COLS = ["CITY", "STATE", "ZIP_MIN"]
+TAIL_SHARE = 0.03   # rows that get a synthetic long-tail manufacturer
+
+def _n_numbers(n: int, rng: np.random.Generator) -> list[str]:
+    # Unique by construction: running number + two letters
+    letters = np.array(list(string.ascii_uppercase))
+    suffix = rng.choice(letters, size=(n, 2))
+    return [f"{i + 1}{a}{b}" for i, (a, b) in enumerate(suffix)]
+
+def _mode_s_codes(n: int, rng: np.random.Generator) -> np.ndarray:
+    # Unique 24-bit addresses, written the way the registry does: 8 octal digits
+    codes = rng.choice(1 << 24, size=n, replace=False)
+    return np.array([f"{c:08o}" for c in codes])
+
+def _dates(n: int, rng: np.random.Generator, start: str, end: str) -> pd.Series:
+    lo, hi = pd.Timestamp(start).value // 86_400_000_000_000, pd.Timestamp(end).value // 86_400_000_000_000
+    days = rng.integers(lo, hi, size=n)
+    return pd.Series(pd.to_datetime(days, unit="D"))
+
+def generate(rows: int, seed_df: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    seed_df = seed_df[NEEDED].reset_index(drop=True)
+
+    types = seed_df[TYPE_COLS].iloc[rng.integers(0, len(seed_df), rows)].reset_index(drop=True)
+    places = seed_df[LOCATION_COLS].iloc[rng.integers(0, len(seed_df), rows)].reset_index(drop=True)
+    df = pd.concat([types, places], axis=1)
+
+    # Long tail of small manufacturers, Zipf-distributed, growing with size
+    tail = rng.random(rows) < TAIL_SHARE
+    n_tail = int(tail.sum())
+    if n_tail:
+        ids = np.minimum(rng.zipf(1.6, n_tail), max(rows // 50, 10))
+        df.loc[tail, "KITMFG"] = [f"SYNTH KITWORKS {i:05d}" for i in ids]
+        df.loc[tail, "KITMDL"] = [f"SK-{i % 7 + 1}" for i in ids]
+
+    df["N-NUMBER"] = _n_numbers(rows, rng)
+    df["SERIAL NUMBER"] = rng.integers(1, 999_999, rows).astype(str)
+    df["MODE S CODE"] = _mode_s_codes(rows, rng)
+
+    cert = _dates(rows, rng, "1975-01-01", "2025-09-30")
+    df["CERT ISSUE DATE"] = cert
+    df["AIR WORTH DATE"] = cert - pd.to_timedelta(rng.integers(0, 3650, rows), unit="D")
+    df["LAST ACTION DATE"] = (cert + pd.to_timedelta(rng.integers(0, 1500, rows), unit="D")).dt.strftime("%m/%d/%Y")
+    year = df["AIR WORTH DATE"].dt.year.astype("float")
+    year[rng.random(rows) < 0.1] = np.nan   # YEAR MFR is often blank in the real file
+    df["YEAR MFR"] = year
+
+    return df[NEEDED]
+
+def write(df: pd.DataFrame, path: str):
+    Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    elif path.endswith(".csv"):
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False, engine="openpyxl")   # Excel tops out at ~1M rows
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic FAA kit registry.")
+    ap.add_argument("--scale", type=float, default=1.0, help=f"multiple of the real size (~{REAL_ROWS:,} rows)")
+    ap.add_argument("--rows", type=int, help="exact row count (overrides --scale)")
+    ap.add_argument("--seed-file", default=os.environ.get("DATA_XLSX", "/app/data/demo.xlsx"))
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", required=True, help=".parquet, .csv or .xlsx")
+    args = ap.parse_args()
+
+    rows = args.rows or int(REAL_ROWS * args.scale)
+    df = generate(rows, read_source(args.seed_file), seed=args.seed)
+    write(df, args.out)
+    print(f"Generated {len(df):,} rows ({df['KITMFG'].nunique():,} kitmfgs) → {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# src/versioned.py
+'''
+Process-local objects derived from `kits` (facet bitmaps, lookup tables, ...)
+that must be rebuilt after each ingest. Ingest stamps `kits_meta.loaded_at`;
+a Versioned holder compares against it at most every RECHECK_SECONDS.
+'''
+import os
+import threading
+import time
+from typing import Callable, Generic, TypeVar
+from sqlalchemy.orm import Session
+import admission
+
+T = TypeVar("T")
+
+# How often (seconds) to ask Postgres whether ingest has produced a new load
+RECHECK_SECONDS = float(os.getenv("INDEX_RECHECK_SECONDS", "5"))
+
+class Versioned(Generic[T]):
+    def __init__(self, name: str, build: Callable[[Session], T]):
+        self.name = name
+        self._build = build
+        self._lock = threading.Lock()
+        self._value: T | None = None
+        self.version = None
+        self._checked_at = 0.0
+
+    def _fresh(self) -> bool:
+        return self._value is not None and time.monotonic() - self._checked_at < RECHECK_SECONDS
+
+    def get(self, db: Session) -> T:
+        if self._fresh():
+            return self._value
+        with self._lock:
+            if self._fresh():
+                return self._value
+            import crud   # not at the top: crud keeps a Versioned of its own (KITS_LAYOUT)
+            version = crud.kits_version(db)
+            if self._value is None or version != self.version:
+                t0 = time.perf_counter()
+                # A full read of kits; it must not fail on the budget of whichever request got here first
+                with admission.unbudgeted(db):
+                    self._value = self._build(db)
+                self.version = version
+                print(f"Built {self.name} in {time.perf_counter() - t0:.2f}s")
+            self._checked_at = time.monotonic()
+        return self._value
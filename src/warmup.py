@@ -0,0 +1,131 @@
+# src/warmup.py
+'''
+Post-ingest warm-up, so the first dashboard hit after a reload costs the same
+as the hundredth:
+
+  1. ANALYZE the freshly built tables (planner stats)
+  2. pg_prewarm their heaps and indexes into shared_buffers (skipped if the
+     extension can't be created)
+  3. replay the dashboard/filter SQL for "All" and every region
+  4. with WARMUP_API_BASE set, replay the same requests against the API once it
+     has picked up the new load (fills its in-memory indexes and rollups)
+
+Each step is a profiling stage, so the time shows up in the ingest run report.
+'''
+import os
+import time
+from datetime import datetime
+import requests
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+import crud
+import regions
+import profiling
+from db import SessionLocal
+
+API_BASE = os.getenv("WARMUP_API_BASE")            # unset = skip the HTTP replay
+API_WAIT = float(os.getenv("WARMUP_API_WAIT", "60"))
+
+def scopes() -> dict[str, list[str] | None]:
+    out: dict[str, list[str] | None] = {regions.ALL: None}
+    for name in regions.REGION_TO_STATES:
+        out[name] = list(regions.canonical_states([name]))
+    return out
+
+def analyze(engine: Engine, tables: list[str]):
+    with profiling.stage("warmup_analyze") as st:
+        with engine.begin() as conn:
+            for t in tables:
+                conn.execute(text(f"ANALYZE {t};"))
+        st["tables"] = len(tables)
+
+def prewarm(engine: Engine, tables: list[str]):
+    with profiling.stage("warmup_prewarm") as st:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_prewarm;"))
+        except DBAPIError as e:
+            print(f"pg_prewarm unavailable, skipping prewarm: {e.orig}")
+            st["skipped"] = True
+            return
+        blocks = 0
+        with engine.begin() as conn:
+            for t in tables:
+                # Leaf partitions (or the table itself) plus every index on them
+                blocks += conn.execute(text("""
+                    SELECT coalesce(sum(pg_prewarm(r)), 0) FROM (
+                        SELECT relid AS r FROM pg_partition_tree(CAST(:t AS regclass)) WHERE isleaf
+                        UNION ALL
+                        SELECT i.indexrelid::regclass FROM pg_partition_tree(CAST(:t AS regclass)) p
+                        JOIN pg_index i ON i.indrelid = p.relid WHERE p.isleaf
+                    ) x;
+                """), {"t": t}).scalar()
+        st["blocks"] = blocks
+    print(f"Prewarmed {blocks:,} blocks from {len(tables)} tables")
+
+def replay_sql():
+    """The queries the dashboard and Search sidebar make, once per scope."""
+    with profiling.stage("warmup_replay") as st:
+        db = SessionLocal()
+        n = 0
+        try:
+            for name, scope in scopes().items():
+                crud.count_by_kitmfg(db, scope)
+                crud.count_by_state(db, scope)
+                crud.count_by_engcat(db, scope)
+                crud.count_distinct_cities(db, scope)
+                crud.timeseries(db, states=scope)
+                n += 5
+            regions.RegionRollups.build(db)
+            kitmfgs = crud.distinct_values(db, "kitmfg")
+            for field in ("mfr", "state"):
+                crud.distinct_values(db, field)
+            if kitmfgs:
+                crud.distinct_values(db, "kitmdl", kitmfg=kitmfgs[0])
+            n += 5
+        finally:
+            db.close()
+        st["rows"] = n
+    print(f"Replayed {n} dashboard queries")
+
+def wait_for_api(loaded_at) -> bool:
+    deadline = time.time() + API_WAIT
+    while time.time() < deadline:
+        try:
+            seen = requests.get(f"{API_BASE}/kits/metrics/facet_index", timeout=30).json()["loaded_at"]
+            if seen and datetime.fromisoformat(seen) == loaded_at:
+                return True
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        time.sleep(1)
+    return False
+
+def replay_http():
+    with profiling.stage("warmup_http") as st:
+        db = SessionLocal()
+        try:
+            loaded_at = crud.kits_version(db)
+        finally:
+            db.close()
+        if not wait_for_api(loaded_at):
+            print(f"API at {API_BASE} didn't pick up the new load within {API_WAIT:g}s, skipping HTTP warm-up")
+            st["skipped"] = True
+            return
+        session = requests.Session()
+        paths = ["/kits/filters/kitmfgs", "/kits/filters/states", "/kits/filters/mfrs", "/kits/facets"]
+        for name in scopes():
+            for path in ("/kits/agg/by_kitmfg", "/kits/agg/by_state", "/kits/agg/by_engcat",
+                         "/kits/metrics/city_count", "/kits/agg/timeseries"):
+                paths.append(f"{path}?region={name}")
+        for p in paths:
+            session.get(f"{API_BASE}{p}", timeout=120)
+        st["rows"] = len(paths)
+    print(f"Replayed {len(paths)} API requests against {API_BASE}")
+
+def run(engine: Engine, tables: list[str]):
+    analyze(engine, tables)
+    prewarm(engine, tables)
+    replay_sql()
+    if API_BASE:
+        replay_http()